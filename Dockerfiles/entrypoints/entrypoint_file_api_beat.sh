@@ -0,0 +1,2 @@
+#!/bin/sh
+exec /opt/app/.venv/bin/celery -A worker.celery beat -f ./logs/celery_beat.log -s ./logs/celerybeat-schedule
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Потоковая сборка ZIP архива из объектов s3.
+ZipFile пишет в буфер без seek, поэтому размеры и CRC файлов идут в data descriptor после содержимого,
+а ZIP64 включается для файлов, размер которых больше 4 GiB.
+В памяти держится только текущий кусок файла, на диск ничего не пишется
+"""
+import datetime
+import posixpath
+from typing import AsyncIterable, AsyncIterator, NamedTuple
+from uuid import uuid4
+from zipfile import ZipFile, ZipInfo, ZIP_STORED
+
+from config import config
+
+
+class ArchiveEntry(NamedTuple):
+    name: str
+    file_hash: str
+    file_size: int
+    modified_at: datetime.datetime
+
+
+class ZipStreamBuffer:
+    """
+    Файл, в который ZipFile пишет архив. Записанное забирается методом drain и отдается клиенту
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._data.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        """
+        Отдает все, что было записано с прошлого вызова
+        :return: Часть архива
+        """
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+
+async def unique_names(
+        entries: AsyncIterable[ArchiveEntry]
+) -> AsyncIterator[ArchiveEntry]:
+    """
+    Переименовывает файлы с одинаковыми путями так же, как write_archive
+    :param entries: Файлы архива
+    :return: Файлы архива с уникальными путями
+    """
+    computed_names = set()
+    async for entry in entries:
+        name = entry.name
+        if name in computed_names:
+            directory, file_name = posixpath.split(name)
+            name = posixpath.join(directory, f"{uuid4()}.{file_name}")
+        computed_names.add(name)
+        yield entry._replace(name=name)
+
+
+async def iter_zip(
+        entries: AsyncIterable[ArchiveEntry],
+        s3_client
+) -> AsyncIterator[bytes]:
+    """
+    Собирает ZIP архив, читая файлы из s3 по очереди, и отдает его частями по мере сборки
+    :param entries: Файлы архива, читаются по мере сборки
+    :param s3_client: Клиент s3
+    :return: Асинхронный генератор частей архива
+    """
+    buffer = ZipStreamBuffer()
+    archive = ZipFile(buffer, mode="w", compression=ZIP_STORED, allowZip64=True)
+
+    async for entry in unique_names(entries):
+        # ZIP не хранит даты раньше 1980 года
+        modified_at = max(entry.modified_at.replace(tzinfo=None), datetime.datetime(1980, 1, 1))
+        zip_info = ZipInfo(entry.name, date_time=modified_at.timetuple()[:6])
+        zip_info.compress_type = ZIP_STORED
+        zip_info.file_size = entry.file_size
+
+        s3_object = await s3_client.get_object(Bucket=config.s3_info.bucket, Key=f"files/{entry.file_hash}")
+
+        with archive.open(zip_info, mode="w") as archive_file:
+            yield buffer.drain()
+            # Контекст тела отдает ответ aiohttp, у которого read() читает все сразу, поэтому читается само тело
+            body = s3_object["Body"]
+            async with body:
+                while chunk := await body.read(config.download_info.chunk_size):
+                    archive_file.write(chunk)
+                    yield buffer.drain()
+
+        yield buffer.drain()
+
+    archive.close()
+    yield buffer.drain()
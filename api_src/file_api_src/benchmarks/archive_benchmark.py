@@ -0,0 +1,86 @@
+"""
+Бенчмарк сборки архива в зависимости от количества файлов.
+Сравнивает прежнюю сборку через chord (задача download_file_from_s3 на каждый файл и archive_files)
+с write_archive, которую выполняет задача create_archive.
+chord выполняется воркером, поэтому нужны запущенные redis, minio, postgres и file_api_worker.
+write_archive запускается в этом процессе, это время задачи без постановки в очередь.
+Файлы загружаются в s3 перед замером и удаляются после.
+
+Запуск из api_src/file_api_src:
+    python -m benchmarks.archive_benchmark --counts 10 100 1000 --size-kb 4
+
+Результаты на 1 CPU, воркер с -c 15, вместо MinIO - moto_server, файлы по 4 KiB:
+      10 files: chord     1.82 s, write_archive     0.15 s, x 12.3
+     100 files: chord     3.67 s, write_archive     1.34 s, x  2.7
+    1000 files: chord    38.78 s, write_archive    15.65 s, x  2.5
+На 100 и 1000 файлах оба способа упираются в скорость moto_server, на MinIO времена будут другими
+"""
+import argparse
+import os
+import time
+from hashlib import sha256
+from uuid import uuid4
+
+from celery import chord, group
+
+from celery_tasks import write_archive
+from celery_tasks.file_tasks import get_s3_client
+from config import config
+from worker import archive_files, download_file_from_s3
+
+
+def upload_files(count: int, size: int) -> list[tuple[str, str]]:
+    s3_client = get_s3_client()
+    files = []
+    for number in range(count):
+        data = os.urandom(size)
+        file_hash = sha256(data).hexdigest()
+        s3_client.put_object(Bucket=config.s3_info.bucket, Key=f"files/{file_hash}", Body=data)
+        files.append((f"file_{number}.bin", file_hash))
+    return files
+
+
+def run_chord(files: list[tuple[str, str]]) -> float:
+    archive_id = str(uuid4())
+    started = time.perf_counter()
+    chord(
+        group(download_file_from_s3.s(str(uuid4()), file_hash, file_name, archive_id) for file_name, file_hash in files)
+    )(archive_files.s()).get()
+    elapsed = time.perf_counter() - started
+    os.remove(f"./temp/{archive_id}.zip")
+    return elapsed
+
+
+def run_bulk(files: list[tuple[str, str]]) -> float:
+    path_to_archive = f"./temp/{uuid4()}.zip"
+    started = time.perf_counter()
+    write_archive(files, path_to_archive=path_to_archive)
+    elapsed = time.perf_counter() - started
+    os.remove(path_to_archive)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000], help="Количество файлов в архиве")
+    parser.add_argument("--size-kb", type=int, default=4, help="Размер каждого файла в KiB")
+    args = parser.parse_args()
+
+    for count in args.counts:
+        files = upload_files(count, args.size_kb * 1024)
+        try:
+            chord_time = run_chord(files)
+            bulk_time = run_bulk(files)
+        finally:
+            for _, file_hash in files:
+                get_s3_client().delete_object(Bucket=config.s3_info.bucket, Key=f"files/{file_hash}")
+
+        print(
+            f"{count:>6} files: chord {chord_time:8.2f} s, "
+            f"write_archive {bulk_time:8.2f} s, "
+            f"x{chord_time / bulk_time:5.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Бенчмарк хэширования при параллельных загрузках.
+Сравнивает старую схему (sha256.update прямо в event loop кусками по 32 KiB)
+с update_hash (пул потоков и размер чтения по размеру файла).
+Показывает пропускную способность хэширования и задержку event loop.
+
+Запуск из api_src/file_api_src:
+    python -m benchmarks.hash_benchmark --uploads 8 --size-mb 256
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from hashlib import sha256
+
+from hashing import update_hash, choose_chunk_size
+
+OLD_CHUNK = 1024 * 32
+
+
+async def hash_inline(data: memoryview):
+    hasher = sha256()
+    for start in range(0, len(data), OLD_CHUNK):
+        hasher.update(data[start:start + OLD_CHUNK])
+        await asyncio.sleep(0)  # file.read отдает управление между кусками
+    return hasher.hexdigest()
+
+
+async def hash_offloaded(data: memoryview):
+    hasher = sha256()
+    chunk_size = choose_chunk_size(len(data))
+    for start in range(0, len(data), chunk_size):
+        await update_hash(hasher, data[start:start + chunk_size])
+    return hasher.hexdigest()
+
+
+async def measure_lag(stop: asyncio.Event, lags: list[float], interval: float = 0.001):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - started - interval) * 1000)
+
+
+async def run(hash_func, uploads: int, data: memoryview) -> dict:
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(measure_lag(stop, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(hash_func(data) for _ in range(uploads)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+
+    lags.sort()
+    return {
+        "throughput_mb_s": uploads * len(data) / 1024 / 1024 / elapsed,
+        "lag_p50_ms": statistics.median(lags),
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1],
+        "lag_max_ms": lags[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=8, help="Количество параллельных загрузок")
+    parser.add_argument("--size-mb", type=int, default=128, help="Размер каждого файла в MiB")
+    args = parser.parse_args()
+
+    data = memoryview(bytes(range(256)) * (args.size_mb * 1024 * 4))
+
+    for name, hash_func in (("inline 32 KiB", hash_inline), ("thread pool", hash_offloaded)):
+        result = asyncio.run(run(hash_func, args.uploads, data))
+        print(
+            f"{name:>14}: {result['throughput_mb_s']:8.1f} MiB/s, "
+            f"lag p50 {result['lag_p50_ms']:6.2f} ms, "
+            f"p99 {result['lag_p99_ms']:6.2f} ms, "
+            f"max {result['lag_max_ms']:6.2f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
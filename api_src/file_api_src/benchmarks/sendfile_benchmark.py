@@ -0,0 +1,128 @@
+"""
+Бенчмарк отдачи файла из кэша.
+Сравнивает процессорное время на 1 GiB для FileResponse (куски по 64 KiB),
+SendfileResponse без расширений сервера (куски по download_info.chunk_size)
+и SendfileResponse с http.response.zerocopysend и http.response.pathsend, где сервер вызывает os.sendfile.
+Сервер имитируется функцией send, которая пишет тело ответа в сокет,
+другой конец сокета вычитывает дочерний процесс, его время не учитывается.
+
+Запуск из api_src/file_api_src:
+    python -m benchmarks.sendfile_benchmark --size-mb 1024 --requests 4
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import time
+from multiprocessing import Process
+
+from fastapi.responses import FileResponse
+
+from responses import SendfileResponse
+
+
+def drain(sock: socket.socket, other_end: socket.socket):
+    other_end.close()
+    while sock.recv(1024 * 1024):
+        pass
+
+
+def sendfile(out_fd: int, in_fd: int, offset: int, count: int):
+    while count > 0:
+        sent = os.sendfile(out_fd, in_fd, offset, count)
+        if not sent:
+            break
+        offset += sent
+        count -= sent
+
+
+def make_send(out_fd: int):
+    async def send(message: dict):
+        if message["type"] == "http.response.body":
+            view = memoryview(message["body"])
+            while view:
+                view = view[os.write(out_fd, view):]
+        elif message["type"] == "http.response.zerocopysend":
+            sendfile(out_fd, message["file"].fileno(), message["offset"], message["count"])
+        elif message["type"] == "http.response.pathsend":
+            with open(message["path"], "rb") as file:
+                sendfile(out_fd, file.fileno(), 0, os.fstat(file.fileno()).st_size)
+
+    return send
+
+
+async def receive():
+    return {"type": "http.disconnect"}
+
+
+async def serve(response_factory, extensions: dict, requests: int, out_fd: int):
+    scope = {"type": "http", "method": "GET", "extensions": extensions}
+    for _ in range(requests):
+        await response_factory()(scope, receive, make_send(out_fd))
+
+
+def measure(name: str, response_factory, extensions: dict, requests: int, size: int, out_fd: int):
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    asyncio.run(serve(response_factory, extensions, requests, out_fd))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    served_gb = requests * size / 1024 ** 3
+    print(
+        f"{name:>22}: {cpu / served_gb:6.3f} CPU s/GiB, "
+        f"{served_gb / elapsed:6.2f} GiB/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512, help="Размер файла в MiB")
+    parser.add_argument("--requests", type=int, default=4, help="Сколько раз отдать файл")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile() as file:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            file.write(block)
+        file.flush()
+
+        server_sock, client_sock = socket.socketpair()
+        drainer = Process(target=drain, args=(client_sock, server_sock))
+        drainer.start()
+        client_sock.close()
+        out_fd = server_sock.fileno()
+        try:
+            measure(
+                "FileResponse 64 KiB",
+                lambda: FileResponse(file.name),
+                {},
+                args.requests, size, out_fd
+            )
+            measure(
+                "SendfileResponse read",
+                lambda: SendfileResponse(file.name),
+                {},
+                args.requests, size, out_fd
+            )
+            measure(
+                "SendfileResponse zero",
+                lambda: SendfileResponse(file.name),
+                {"http.response.zerocopysend": {}},
+                args.requests, size, out_fd
+            )
+            measure(
+                "SendfileResponse path",
+                lambda: SendfileResponse(file.name),
+                {"http.response.pathsend": {}},
+                args.requests, size, out_fd
+            )
+        finally:
+            server_sock.close()
+            drainer.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,9 @@
 from celery_tasks.file_tasks import (
     move_file_to_cache, # noqa
+    evict_cache_files, # noqa
     download_file # noqa
 )
+from celery_tasks.archive_tasks import (
+    write_archive, # noqa
+    iter_folder_files # noqa
+)
@@ -0,0 +1,139 @@
+import os
+import posixpath
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator
+from zipfile import ZipFile
+
+import psycopg
+
+from config import config
+from celery_tasks.file_tasks import get_s3_client
+
+
+# Файлы всего поддерева папки с путями относительно нее, отсортированные по хэшу.
+# visited - ID папок на пути от корня, папка, которая уже есть на пути, не обходится,
+# поэтому ссылка корня на себя и любые другие циклы в дереве не зацикливают запрос
+FOLDER_FILES_QUERY = """
+with recursive folders (id, path, visited) as (
+    select id, ''::text, array[id]
+    from app.files_tree
+    where id = %(folder_id)s
+    union all
+    select child.id, folders.path || child.name || '/', folders.visited || child.id
+    from app.files_tree child
+    join folders on child.parent_id = folders.id
+    where child.id <> all(folders.visited)
+)
+select folders.path || files.name, files.hash
+from folders
+join app.files files on files.parent_id = folders.id
+order by files.hash, 1
+"""
+
+
+def iter_folder_files(
+        conn: psycopg.Connection,
+        folder_id: str,
+        archive_id: str
+) -> Iterator[tuple[str, str]]:
+    """
+    Отдает файлы поддерева папки через серверный курсор,
+    поэтому в памяти держится только одна пачка строк, а не весь список
+    :param conn: Соединение с базой, открытое на все время чтения
+    :param folder_id: ID папки
+    :param archive_id: ID архива, из него составляется имя курсора
+    :return: Пары (путь файла внутри архива, хэш файла)
+    """
+    with conn.cursor(name=f"archive_{archive_id}") as cursor:
+        cursor.itersize = config.archive_info.cursor_size
+        cursor.execute(FOLDER_FILES_QUERY, {"folder_id": folder_id})
+        yield from cursor
+
+
+def fetch_file(
+        file_hash: str
+) -> str:
+    """
+    Скачивает файл из s3 во временный файл
+    :param file_hash: Хэш файла
+    :return: Путь к скачанному файлу
+    """
+    path_to_file = f"./temp/{uuid.uuid4()}"
+    get_s3_client().download_file(
+        config.s3_info.bucket,
+        f"files/{file_hash}",
+        path_to_file
+    )
+    return path_to_file
+
+
+def group_by_hash(
+        files: Iterable[tuple[str, str]]
+) -> Iterator[tuple[str, list[str]]]:
+    """
+    Объединяет идущие подряд файлы с одинаковым хэшем, чтобы каждое содержимое скачивалось один раз.
+    В памяти держится только текущая группа, поэтому файлы должны идти отсортированными по хэшу,
+    иначе содержимое скачается по разу на каждую группу
+    :param files: Пары (имя файла, хэш файла)
+    :return: Пары (хэш файла, имена, под которыми он попадет в архив)
+    """
+    for file_hash, group in groupby(files, key=itemgetter(1)):
+        yield file_hash, [name for name, _ in group]
+
+
+def write_archive(
+        files: Iterable[tuple[str, str]],
+        path_to_archive: str
+) -> str:
+    """
+    Собирает ZIP архив в одной задаче.
+    Каждое содержимое качается один раз и записывается в архив под всеми своими именами,
+    если файлы отсортированы по хэшу.
+    Файлы качаются пулом потоков не больше чем по archive_concurrency одновременно
+    и дописываются в архив по порядку сразу после скачивания,
+    поэтому в ./temp одновременно лежит не больше 2 * archive_concurrency файлов
+    :param files: Пары (путь файла внутри архива, хэш файла), лучше отсортированные по хэшу
+    :param path_to_archive: Путь к архиву
+    :return: Путь к архиву
+    """
+    groups = group_by_hash(files)
+    window = config.s3_info.archive_concurrency * 2
+    pending: deque[tuple[list[str], Future]] = deque()
+
+    with ThreadPoolExecutor(max_workers=config.s3_info.archive_concurrency) as executor:
+        def submit_next():
+            for file_hash, names in groups:
+                pending.append((names, executor.submit(fetch_file, file_hash)))
+                return
+
+        try:
+            with ZipFile(path_to_archive, "w") as archive:
+                for _ in range(window):
+                    submit_next()
+
+                while pending:
+                    names, future = pending.popleft()
+                    submit_next()
+
+                    path_to_file = future.result()
+                    try:
+                        for name in names:
+                            # ZipFile и так хранит все имена для оглавления архива, отдельное множество не нужно
+                            if name in archive.NameToInfo:
+                                directory, file_name = posixpath.split(name)
+                                name = posixpath.join(directory, f"{uuid.uuid4()}.{file_name}")
+                            archive.write(path_to_file, arcname=name)
+                    finally:
+                        os.remove(path_to_file)
+        finally:
+            # Если архив собрать не удалось, удаляем уже скачанные файлы
+            for _, future in pending:
+                future.cancel()
+                if not future.cancelled() and not future.exception():
+                    os.remove(future.result())
+
+    return path_to_archive
@@ -1,9 +1,45 @@
 import os
-import redis
+import time
+import uuid
 from config import config
 import boto3
 import json
 import shutil
+from functools import cache
+from typing import Optional
+
+from botocore.config import Config
+
+from file_cache import (
+    CACHE_LRU_KEY,
+    CACHE_SIZE_KEY,
+    CACHE_STATS_KEY,
+    blob_cache_key,
+    cache_entry_lock_key,
+    cache_path,
+    file_meta_key
+)
+from redis_pool import get_sync_redis
+
+
+@cache
+def get_s3_client():
+    """
+    Создает клиент s3 с пулом соединений, один на процесс воркера.
+    Клиент boto3 потокобезопасен, поэтому его используют и потоки, которые качают файлы для архивов.
+    Клиент создается при первом вызове, то есть уже в дочернем процессе селери
+    :return: Клиент s3
+    """
+    return boto3.Session().client(
+        "s3",
+        endpoint_url=config.s3_info.endpoint,
+        aws_access_key_id=config.s3_info.access_key,
+        aws_secret_access_key=config.s3_info.secret_key,
+        config=Config(
+            max_pool_connections=config.s3_info.max_pool_connections,
+            tcp_keepalive=True
+        )
+    )
 
 
 def move_file_to_cache(
@@ -11,23 +47,135 @@ def move_file_to_cache(
         file_hash: str,
         file_id: str,
         file_name: str
-):
-    r = redis.Redis(host=config.cache_info.redis_host, port=config.cache_info.redis_port, db=1)
+) -> Optional[str]:
+    """
+    Переносит скачанный файл в кэш по хэшу содержимого.
+    Файл сначала переносится во временный файл в ./cache и затем атомарно переименовывается,
+    поэтому API никогда не видит недописанный файл.
+    Файл учитывается в размере кэша и индексе LRU, из которого его потом вытеснит evict_cache_files.
+    Файлы больше всего кэша в него не попадают.
+    Файл кладется в кэш под блокировкой cache_entry_lock_key, которую держит и вытеснение
+    :param path_to_file: Путь к скачанному файлу
+    :param file_hash: Хэш файла
+    :param file_id: ID файла
+    :param file_name: Имя файла
+    :return: Путь к файлу в кэше или None, если файл слишком большой для кэша
+    """
+    r = get_sync_redis()
+
+    file_size = os.path.getsize(path_to_file)
+    r.set(
+        file_meta_key(file_id),
+        json.dumps({"file_hash": file_hash, "file_name": file_name, "file_size": file_size}),
+        ex=config.cache_info.ttl
+    )
+
+    if file_size > config.cache_info.max_size:
+        os.remove(path_to_file)
+        return None
 
-    if r.get(f"cache:{file_id}"):
-        r.close()
-        return
-    path_to_cache = f"./cache/{file_hash}"
-    shutil.move(path_to_file, path_to_cache)
+    path_to_cache = cache_path(file_hash)
+    path_to_partial = f"{path_to_cache}.{uuid.uuid4()}.partial"
+    # Файл переносится в ./cache до блокировки, под ней остается только переименование
+    shutil.move(path_to_file, path_to_partial)
 
-    file_info = {
-        "path_to_cache": path_to_cache,
-        "file_name": file_name
-    }
+    try:
+        with r.lock(
+                cache_entry_lock_key(file_hash),
+                timeout=config.cache_info.entry_lock_timeout,
+                blocking_timeout=config.cache_info.entry_lock_timeout
+        ):
+            if r.exists(blob_cache_key(file_hash)) and os.path.exists(path_to_cache):
+                os.remove(path_to_partial)
+                return path_to_cache
 
-    r.set(f"cache:{file_id}", json.dumps(file_info), nx=True, ex=config.cache_info.ttl)
-    r.close()
-    os.remove(path_to_file)
+            os.replace(path_to_partial, path_to_cache)
+
+            file_info = {
+                "path_to_cache": path_to_cache,
+                "file_size": file_size
+            }
+
+            # Размер увеличивает только тот, кто первым записал ключ, поэтому файл не учитывается дважды
+            admitted = r.set(blob_cache_key(file_hash), json.dumps(file_info), nx=True)
+            with r.pipeline(transaction=False) as pipe:
+                if admitted:
+                    pipe.incrby(CACHE_SIZE_KEY, file_size)
+                pipe.zadd(CACHE_LRU_KEY, {file_hash: time.time()})
+                pipe.execute()
+    except Exception:
+        if os.path.exists(path_to_partial):
+            os.remove(path_to_partial)
+        raise
+    return path_to_cache
+
+
+def evict_cache_files() -> int:
+    """
+    Вытесняет из кэша файлы, к которым дольше всего не обращались,
+    пока размер кэша не опустится до max_size * evict_target.
+    Файл, к которому обратились во время вытеснения, остается в кэше.
+    Записи в redis и сам файл удаляются под блокировкой cache_entry_lock_key,
+    поэтому файл, который в это время заново кладут в кэш, не удаляется
+    :return: Количество удаленных файлов
+    """
+    r = get_sync_redis()
+
+    cache_size = int(r.get(CACHE_SIZE_KEY) or 0)
+    if cache_size <= config.cache_info.max_size:
+        return 0
+
+    target_size = int(config.cache_info.max_size * config.cache_info.evict_target)
+    evicted = 0
+
+    while cache_size > target_size:
+        oldest = r.zrange(CACHE_LRU_KEY, 0, 99, withscores=True)
+        if not oldest:
+            break
+
+        evicted_before = evicted
+        for file_hash, last_access in oldest:
+            if cache_size <= target_size:
+                break
+
+            file_hash = file_hash.decode()
+            lock = r.lock(cache_entry_lock_key(file_hash), timeout=config.cache_info.entry_lock_timeout)
+            # Файл, который сейчас кладут в кэш, пропускается: он только что стал самым свежим
+            if not lock.acquire(blocking=False):
+                continue
+
+            try:
+                if r.zscore(CACHE_LRU_KEY, file_hash) != last_access:
+                    continue
+
+                with r.pipeline() as pipe:
+                    pipe.get(blob_cache_key(file_hash))
+                    pipe.delete(blob_cache_key(file_hash))
+                    pipe.zrem(CACHE_LRU_KEY, file_hash)
+                    cache_info, deleted, _ = pipe.execute()
+                if not cache_info or not deleted:
+                    continue
+
+                cache_info = json.loads(cache_info)
+                if os.path.exists(cache_info["path_to_cache"]):
+                    os.remove(cache_info["path_to_cache"])
+            finally:
+                lock.release()
+
+            with r.pipeline() as pipe:
+                pipe.decrby(CACHE_SIZE_KEY, cache_info["file_size"])
+                pipe.hincrby(CACHE_STATS_KEY, "evictions", 1)
+                pipe.execute()
+
+            cache_size -= cache_info["file_size"]
+            evicted += 1
+
+        # Все самые старые файлы сейчас заняты: следующий проход увидел бы их же,
+        # поэтому вытеснение продолжится при следующем запуске задачи
+        if evicted == evicted_before:
+            break
+
+    return evicted
 
 
 def download_file(
@@ -41,21 +189,11 @@ def download_file(
     :return: Путь к скаченному файлу
     """
     path_to_file = f"./temp/{file_id}"
-    s3_session  = boto3.Session()
 
-    s3_client = s3_session.client(
-        "s3",
-        endpoint_url=config.s3_info.endpoint,
-        aws_access_key_id=config.s3_info.access_key,
-        aws_secret_access_key=config.s3_info.secret_key
-    )
-
-    s3_client.download_file(
+    get_s3_client().download_file(
         config.s3_info.bucket,
         f"files/{file_hash}",
         path_to_file
     )
 
-    s3_client.close()
-
     return path_to_file
@@ -17,14 +17,52 @@ class APIInfo(BaseModel):
 
 class S3Info(BaseModel):
     endpoint: str = os.environ.get('S3_ENDPOINT', "http://127.0.0.1:9000")
+    public_endpoint: str = os.environ.get('S3_PUBLIC_ENDPOINT', os.environ.get('S3_ENDPOINT', "http://127.0.0.1:9000")) # адрес s3 для ссылок, которые открывает клиент
     bucket: str = os.environ.get('S3_BUCKET', "files")
     access_key: str = os.environ.get('S3_ACCESS_KEY', "minioadmin")
     secret_key: str = os.environ.get('S3_SECRET_KEY', "minioadmin")
+    part_size: int = os.environ.get('S3_PART_SIZE', 1024 * 1024 * 8) # не меньше 5 MiB
+    multipart_threshold: int = os.environ.get('S3_MULTIPART_THRESHOLD', 1024 * 1024 * 16)
+    max_concurrency: int = os.environ.get('S3_MAX_CONCURRENCY', 4)
+    batch_concurrency: int = os.environ.get('S3_BATCH_CONCURRENCY', 4)
+    max_pool_connections: int = os.environ.get('S3_MAX_POOL_CONNECTIONS', 50)
+    keepalive_timeout: int = os.environ.get('S3_KEEPALIVE_TIMEOUT', 60)
+    archive_concurrency: int = os.environ.get('S3_ARCHIVE_CONCURRENCY', 16) # потоков скачивания на один архив
 
 class CacheInfo(BaseModel):
     redis_host: str = os.environ.get("REDIS_HOST", "127.0.0.1")
     redis_port: int = os.environ.get("REDIS_PORT", 6379)
+    max_connections: int = os.environ.get("REDIS_MAX_CONNECTIONS", 50)
+    pool_timeout: int = os.environ.get("REDIS_POOL_TIMEOUT", 5) # seconds ожидания свободного соединения
+    health_check_interval: int = os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30) # seconds
     ttl: int = os.environ.get("TTL", 1 * 60 * 60 * 6 ) # 6 hours
+    upload_session_ttl: int = os.environ.get("UPLOAD_SESSION_TTL", 1 * 60 * 60 * 24) # 24 hours
+    max_size: int = os.environ.get("CACHE_MAX_SIZE", 1024 * 1024 * 1024 * 10) # 10 GiB
+    evict_target: float = os.environ.get("CACHE_EVICT_TARGET", 0.9) # доля max_size после вытеснения
+    evict_interval: int = os.environ.get("CACHE_EVICT_INTERVAL", 60) # seconds
+    fetch_lock_timeout: int = os.environ.get("CACHE_FETCH_LOCK_TIMEOUT", 30) # seconds, продлевается, пока файл качается
+    entry_lock_timeout: int = os.environ.get("CACHE_ENTRY_LOCK_TIMEOUT", 30) # seconds
+    upload_lock_timeout: int = os.environ.get("UPLOAD_LOCK_TIMEOUT", 30) # seconds
+    memory_max_size: int = os.environ.get("CACHE_MEMORY_MAX_SIZE", 1024 * 1024 * 256) # на процесс API
+    memory_max_file_size: int = os.environ.get("CACHE_MEMORY_MAX_FILE_SIZE", 1024 * 256)
+    meta_max_entries: int = os.environ.get("CACHE_META_MAX_ENTRIES", 10000) # на процесс API
+    meta_ttl: int = os.environ.get("CACHE_META_TTL", 60) # seconds
+
+
+class DownloadInfo(BaseModel):
+    mode: str = os.environ.get("DOWNLOAD_MODE", "file") # file - через ./temp, stream - потоком из s3, redirect - ссылкой на s3
+    presigned_url_ttl: int = os.environ.get("DOWNLOAD_PRESIGNED_URL_TTL", 60 * 5) # seconds
+    chunk_size: int = os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 256)
+    cache_on_stream: bool = os.environ.get("DOWNLOAD_CACHE_ON_STREAM", True)
+    max_ranges: int = os.environ.get("DOWNLOAD_MAX_RANGES", 16)
+    cache_control: str = os.environ.get("DOWNLOAD_CACHE_CONTROL", "public, max-age=3600")
+
+
+class ArchiveInfo(BaseModel):
+    # Упавшую сборку воркер отмечает как failed. Если воркер умер, не успев этого сделать,
+    # сборка, которая идет дольше, тоже считается упавшей, и архив с тем же содержимым собирается заново
+    pending_timeout: int = os.environ.get("ARCHIVE_PENDING_TIMEOUT", 60 * 60) # seconds
+    cursor_size: int = os.environ.get("ARCHIVE_CURSOR_SIZE", 2000) # строк за одно чтение серверного курсора
 
 
 class Config(BaseModel):
@@ -32,7 +70,11 @@ class Config(BaseModel):
     api_info: APIInfo = APIInfo()
     s3_info: S3Info = S3Info()
     cache_info: CacheInfo = CacheInfo()
-    file_chunk: int = os.environ.get("CHUNK_SIZE", 1024 * 32)
+    download_info: DownloadInfo = DownloadInfo()
+    archive_info: ArchiveInfo = ArchiveInfo()
+    file_chunk: int = os.environ.get("CHUNK_SIZE", 1024 * 64)
+    hash_max_chunk: int = os.environ.get("HASH_MAX_CHUNK_SIZE", 1024 * 1024 * 8)
+    hash_workers: int = os.environ.get("HASH_WORKERS", os.cpu_count() or 4)
 
 
 config = Config()
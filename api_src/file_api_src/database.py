@@ -17,12 +17,15 @@ async_engine: AsyncEngine = create_async_engine(
     max_overflow=config.db_info.max_overflow
 )
 
+async_session_maker: async_sessionmaker[AsyncSession] = async_sessionmaker(
+    bind=async_engine,
+    autocommit=False,
+    expire_on_commit=False
+)
+
+
 async def get_async_session() -> async_sessionmaker[AsyncSession]:
-    return async_sessionmaker(
-        bind=async_engine,
-        autocommit=False,
-        expire_on_commit=False
-    )
+    return async_session_maker
 
 
 class Base(DeclarativeBase):
@@ -0,0 +1,64 @@
+"""
+Ключи и пути локального кэша файлов.
+Файлы в ./cache хранятся по хэшу содержимого, поэтому одна загрузка
+прогревает кэш для всех записей app.files с этим хэшем
+"""
+import os
+
+CACHE_DIR = "./cache"
+
+# Время последнего обращения к каждому файлу в кэше, по нему вытесняются самые старые файлы
+CACHE_LRU_KEY = "cache_index:lru"
+# Суммарный размер файлов в кэше в байтах
+CACHE_SIZE_KEY = "cache_index:size"
+# Счетчики hits, misses и evictions
+CACHE_STATS_KEY = "cache_index:stats"
+# Канал, в который публикуются ID переименованных и удаленных файлов
+FILE_META_CHANNEL = "file_meta:invalidate"
+
+
+def cache_path(file_hash: str) -> str:
+    """
+    Путь к файлу в кэше
+    :param file_hash: Хэш файла
+    :return: Путь к файлу
+    """
+    return os.path.join(CACHE_DIR, file_hash)
+
+
+def blob_cache_key(file_hash: str) -> str:
+    """
+    Ключ redis с информацией о файле в кэше по хэшу содержимого
+    :param file_hash: Хэш файла
+    :return: Ключ redis
+    """
+    return f"cache:{file_hash}"
+
+
+def file_meta_key(file_id: str) -> str:
+    """
+    Ключ redis с хэшем, именем и размером файла по ID записи в app.files
+    :param file_id: ID файла
+    :return: Ключ redis
+    """
+    return f"file:{file_id}"
+
+
+def fetch_lock_key(file_hash: str) -> str:
+    """
+    Ключ redis блокировки, которую держит реплика, скачивающая файл с s3 в кэш
+    :param file_hash: Хэш файла
+    :return: Ключ redis
+    """
+    return f"cache_fetch:{file_hash}"
+
+
+def cache_entry_lock_key(file_hash: str) -> str:
+    """
+    Ключ redis блокировки файла в кэше.
+    Ее держат, пока файл кладут в кэш или вытесняют из него,
+    чтобы вытеснение не удалило файл, который только что положили заново
+    :param file_hash: Хэш файла
+    :return: Ключ redis
+    """
+    return f"cache_entry:{file_hash}"
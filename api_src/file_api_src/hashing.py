@@ -0,0 +1,100 @@
+import asyncio
+import ctypes
+import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from config import config
+
+# hashlib отпускает GIL уже на буферах больше 2 KiB, но передача в пул потоков тоже стоит времени:
+# до 64 KiB она обходится дороже самого хэширования, поэтому такие буферы считаются на месте
+HASH_OFFLOAD_THRESHOLD = 1024 * 64
+
+hash_executor = ThreadPoolExecutor(
+    max_workers=config.hash_workers,
+    thread_name_prefix="hash"
+)
+
+# libcrypto уже загружен самим python для hashlib и ssl. Вызовы через ctypes отпускают GIL
+libcrypto = ctypes.CDLL(ctypes.util.find_library("crypto") or "libcrypto.so.3")
+libcrypto.SHA256_Init.argtypes = [ctypes.c_void_p]
+libcrypto.SHA256_Update.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
+libcrypto.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+
+# sizeof(SHA256_CTX): h[8], Nl, Nh, data[16], num, md_len по 4 байта
+SHA256_CTX_SIZE = 112
+
+
+class Sha256State:
+    """
+    sha256, промежуточное состояние которого можно сохранить и продолжить в другом процессе.
+    hashlib свое состояние наружу не отдает, поэтому хэш считается через SHA256_* из libcrypto,
+    с той же скоростью, что и hashlib
+    """
+
+    def __init__(
+            self,
+            state: Optional[bytes] = None
+    ):
+        """
+        :param state: Сохраненное состояние из state() или None для нового хэша
+        """
+        if state is not None:
+            if len(state) != SHA256_CTX_SIZE:
+                raise ValueError("Неверный размер состояния sha256")
+            self._ctx = ctypes.create_string_buffer(state, SHA256_CTX_SIZE)
+        else:
+            self._ctx = ctypes.create_string_buffer(SHA256_CTX_SIZE)
+            libcrypto.SHA256_Init(self._ctx)
+
+    def update(self, data: bytes):
+        libcrypto.SHA256_Update(self._ctx, data, len(data))
+
+    def state(self) -> bytes:
+        """
+        :return: Промежуточное состояние хэша
+        """
+        return self._ctx.raw
+
+    def hexdigest(self) -> str:
+        """
+        Считает хэш, не меняя состояние, так же как hashlib
+        :return: sha256 в hex
+        """
+        ctx = ctypes.create_string_buffer(self._ctx.raw, SHA256_CTX_SIZE)
+        digest = ctypes.create_string_buffer(32)
+        libcrypto.SHA256_Final(digest, ctx)
+        return digest.raw.hex()
+
+
+async def update_hash(
+        hasher,
+        data: bytes
+):
+    """
+    Добавляет данные в хэш, не блокируя event loop.
+    Большие буферы считаются в отдельном пуле потоков и могут использовать другие ядра
+    :param hasher: Объект хэша из hashlib или Sha256State
+    :param data: Данные
+    :return:
+    """
+    if len(data) < HASH_OFFLOAD_THRESHOLD:
+        hasher.update(data)
+        return
+
+    await asyncio.get_running_loop().run_in_executor(hash_executor, hasher.update, data)
+
+
+def choose_chunk_size(
+        file_size: Optional[int]
+) -> int:
+    """
+    Выбирает размер чтения файла для хэширования по размеру файла:
+    примерно 1/16 файла, но не меньше config.file_chunk и не больше config.hash_max_chunk
+    :param file_size: Размер файла, если он известен
+    :return: Размер чтения в байтах
+    """
+    if not file_size:
+        return config.file_chunk
+
+    return min(max(file_size // 16, config.file_chunk), config.hash_max_chunk)
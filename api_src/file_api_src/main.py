@@ -1,33 +1,35 @@
+import asyncio
+
 from fastapi import FastAPI
 from config import config
-from routers import file_router, archive_router
+from routers import file_router, archive_router, upload_router
 from contextlib import asynccontextmanager
-import aioboto3
 from botocore.exceptions import ClientError
 
+from meta_cache import listen_file_meta_invalidations
+from redis_pool import redis_pool
+from storage import create_s3_client
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    s3_session = aioboto3.Session()
-
-    try:
-        async with s3_session.client(
-            "s3",
-            endpoint_url=config.s3_info.endpoint,
-            aws_access_key_id=config.s3_info.access_key,
-            aws_secret_access_key=config.s3_info.secret_key
-        ) as client:
+    async with (
+        create_s3_client() as client,
+        create_s3_client(endpoint=config.s3_info.public_endpoint) as presign_client
+    ):
+        app.state.s3_client = client
+        app.state.s3_presign_client = presign_client
+
+        try:
             await client.head_bucket(Bucket=config.s3_info.bucket)
-    except ClientError:
-        async with s3_session.client(
-                "s3",
-                endpoint_url=config.s3_info.endpoint,
-                aws_access_key_id=config.s3_info.access_key,
-                aws_secret_access_key=config.s3_info.secret_key
-        ) as client:
+        except ClientError:
             await client.create_bucket(Bucket=config.s3_info.bucket)
 
-    yield
+        invalidation_listener = asyncio.create_task(listen_file_meta_invalidations())
+        yield
+        invalidation_listener.cancel()
+
+    await redis_pool.disconnect()
 
 
 app = FastAPI(
@@ -41,3 +43,4 @@ app = FastAPI(
 
 app.include_router(file_router)
 app.include_router(archive_router)
+app.include_router(upload_router)
@@ -0,0 +1,89 @@
+"""
+Кэш маленьких файлов в памяти процесса API.
+Содержимое адресуется хэшем, поэтому записи никогда не устаревают и вытесняются только по LRU
+"""
+from collections import OrderedDict
+from typing import Optional
+
+from config import config
+
+
+class MemoryCache:
+    """
+    LRU кэш содержимого файлов с ограничением по суммарному размеру
+    """
+
+    def __init__(
+            self,
+            max_size: int,
+            max_file_size: int
+    ):
+        """
+        :param max_size: Максимальный суммарный размер файлов в байтах
+        :param max_file_size: Файлы больше этого размера в кэш не попадают
+        """
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files: OrderedDict[str, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def accepts(
+            self,
+            file_size: int
+    ) -> bool:
+        """
+        Проверяет, может ли файл такого размера храниться в памяти
+        :param file_size: Размер файла
+        :return: True, если файл достаточно маленький
+        """
+        return file_size <= min(self.max_file_size, self.max_size)
+
+    def get(
+            self,
+            file_hash: str
+    ) -> Optional[bytes]:
+        """
+        Отдает содержимое файла и отмечает его как последний использованный
+        :param file_hash: Хэш файла
+        :return: Содержимое файла или None, если его нет в памяти
+        """
+        data = self._files.get(file_hash)
+        if data is None:
+            self.misses += 1
+            return None
+
+        self._files.move_to_end(file_hash)
+        self.hits += 1
+        return data
+
+    def put(
+            self,
+            file_hash: str,
+            data: bytes
+    ):
+        """
+        Кладет содержимое файла в память, вытесняя файлы, к которым дольше всего не обращались
+        :param file_hash: Хэш файла
+        :param data: Содержимое файла
+        :return:
+        """
+        if not self.accepts(len(data)) or file_hash in self._files:
+            return
+
+        while self._files and self.size + len(data) > self.max_size:
+            _, evicted = self._files.popitem(last=False)
+            self.size -= len(evicted)
+
+        self._files[file_hash] = data
+        self.size += len(data)
+
+
+memory_cache = MemoryCache(
+    max_size=config.cache_info.memory_max_size,
+    max_file_size=config.cache_info.memory_max_file_size
+)
@@ -0,0 +1,129 @@
+"""
+Кэш метаданных файлов (хэш, имя, размер) в памяти процесса API.
+При переименовании и удалении файла запись удаляется на всех репликах через pub/sub redis
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import config
+from file_cache import FILE_META_CHANNEL
+from redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class MetaCache:
+    """
+    LRU кэш метаданных файлов по ID с ограничением по количеству записей и временем жизни
+    """
+
+    def __init__(
+            self,
+            max_entries: int,
+            ttl: int
+    ):
+        """
+        :param max_entries: Максимальное количество записей
+        :param ttl: Время жизни записи в секундах
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(
+            self,
+            file_id: str
+    ) -> Optional[dict]:
+        """
+        Отдает метаданные файла, если запись есть и еще не устарела
+        :param file_id: ID файла
+        :return: Метаданные файла или None
+        """
+        entry = self._entries.get(file_id)
+        if not entry:
+            return None
+
+        expires_at, file_meta = entry
+        if expires_at < time.monotonic():
+            del self._entries[file_id]
+            return None
+
+        self._entries.move_to_end(file_id)
+        return file_meta
+
+    def put(
+            self,
+            file_id: str,
+            file_meta: dict
+    ):
+        """
+        Сохраняет метаданные файла, вытесняя записи, к которым дольше всего не обращались
+        :param file_id: ID файла
+        :param file_meta: Метаданные файла
+        :return:
+        """
+        self._entries[file_id] = (time.monotonic() + self.ttl, file_meta)
+        self._entries.move_to_end(file_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(
+            self,
+            file_id: str
+    ):
+        """
+        Удаляет метаданные файла
+        :param file_id: ID файла
+        :return:
+        """
+        self._entries.pop(file_id, None)
+
+    def clear(self):
+        """
+        Удаляет все записи
+        :return:
+        """
+        self._entries.clear()
+
+
+file_meta_cache = MetaCache(
+    max_entries=config.cache_info.meta_max_entries,
+    ttl=config.cache_info.meta_ttl
+)
+
+
+async def publish_file_meta_invalidation(
+        file_id: str
+):
+    """
+    Удаляет метаданные файла из кэша этого процесса и сообщает об этом остальным репликам
+    :param file_id: ID файла
+    :return:
+    """
+    file_meta_cache.forget(file_id)
+    await get_redis().publish(FILE_META_CHANNEL, file_id)
+
+
+async def listen_file_meta_invalidations():
+    """
+    Слушает канал redis и удаляет из кэша метаданные измененных файлов.
+    Пока подписки нет, сообщения могли потеряться, поэтому после переподключения кэш очищается
+    :return:
+    """
+    while True:
+        try:
+            async with get_redis().pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(FILE_META_CHANNEL)
+                file_meta_cache.clear()
+
+                async for message in pubsub.listen():
+                    file_meta_cache.forget(message["data"].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.warning("Подписка на инвалидацию метаданных файлов прервана: %s", err)
+            file_meta_cache.clear()
+            await asyncio.sleep(1)
@@ -76,6 +76,7 @@ class ArchiveRequest(Base):
     created_at: Mapped[created_at]
     created_by: Mapped[str] = Column(Text, nullable=False, index=True)
     finished_at: Mapped[finished_at]
+    fingerprint: Mapped[str] = Column(Text, nullable=True, index=True)
 
 
     __table_args__ = (
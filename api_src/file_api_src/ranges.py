@@ -0,0 +1,222 @@
+"""
+Поддержка HTTP Range запросов (206 Partial Content) для скачивания файлов
+"""
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from uuid import uuid4
+
+import anyio
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from config import config
+
+RangeOpener = Callable[[int, int], Awaitable[AsyncIterator[bytes]]]
+
+
+def parse_range_header(
+        range_header: str,
+        size: int
+) -> Optional[list[tuple[int, int]]]:
+    """
+    Разбирает заголовок Range.
+    Пересекающиеся и соседние диапазоны объединяются
+    :param range_header: Значение заголовка Range
+    :param size: Размер файла
+    :return: Список диапазонов (начало, конец включительно),
+    пустой список, если ни один диапазон не попадает в файл,
+    или None, если заголовок надо проигнорировать и отдать файл целиком
+    """
+    unit, _, ranges_spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for spec in ranges_spec.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+
+        start, separator, end = spec.partition("-")
+        if not separator:
+            return None
+
+        try:
+            if not start:
+                suffix_length = int(end)
+                # В пустом файле нет ни одного байта, который можно отдать, ответ будет 416
+                if suffix_length <= 0 or size == 0:
+                    continue
+                ranges.append((max(size - suffix_length, 0), size - 1))
+                continue
+
+            start = int(start)
+            end = int(end) if end else None
+        except ValueError:
+            return None
+
+        if end is not None and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > config.download_info.max_ranges:
+        return None
+
+    return merged
+
+
+def range_not_satisfiable(
+        size: int
+) -> Response:
+    """
+    Ответ 416, если запрошенные диапазоны не попадают в файл
+    :param size: Размер файла
+    :return: Ответ 416
+    """
+    return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+
+async def open_file_range(
+        path: str,
+        start: int,
+        end: int
+) -> AsyncIterator[bytes]:
+    """
+    Открывает диапазон локального файла
+    :param path: Путь к файлу
+    :param start: Начало диапазона
+    :param end: Конец диапазона включительно
+    :return: Асинхронный итератор по содержимому диапазона
+    """
+    async def iter_range():
+        async with await anyio.open_file(path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(min(config.download_info.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return iter_range()
+
+
+async def open_bytes_range(
+        data: bytes,
+        start: int,
+        end: int
+) -> AsyncIterator[bytes]:
+    """
+    Открывает диапазон файла, который уже лежит в памяти
+    :param data: Содержимое файла
+    :param start: Начало диапазона
+    :param end: Конец диапазона включительно
+    :return: Асинхронный итератор по содержимому диапазона
+    """
+    async def iter_range():
+        yield data[start:end + 1]
+
+    return iter_range()
+
+
+async def open_s3_range(
+        s3_client,
+        key: str,
+        start: int,
+        end: int
+) -> AsyncIterator[bytes]:
+    """
+    Открывает диапазон объекта s3 через GetObject с заголовком Range.
+    Запрос к s3 выполняется сразу, чтобы ошибка вернулась до начала ответа
+    :param s3_client: Клиент s3
+    :param key: Ключ объекта
+    :param start: Начало диапазона
+    :param end: Конец диапазона включительно
+    :return: Асинхронный итератор по содержимому диапазона
+    """
+    s3_object = await s3_client.get_object(
+        Bucket=config.s3_info.bucket,
+        Key=key,
+        Range=f"bytes={start}-{end}"
+    )
+
+    async def iter_range():
+        # Контекст тела отдает ответ aiohttp, у которого read() читает все сразу, поэтому читается само тело
+        body = s3_object["Body"]
+        async with body:
+            while chunk := await body.read(config.download_info.chunk_size):
+                yield chunk
+
+    return iter_range()
+
+
+async def ranged_response(
+        ranges: list[tuple[int, int]],
+        size: int,
+        media_type: str,
+        headers: dict[str, str],
+        open_range: RangeOpener
+) -> StreamingResponse:
+    """
+    Собирает ответ 206 для одного диапазона или multipart/byteranges для нескольких
+    :param ranges: Диапазоны из parse_range_header
+    :param size: Размер файла
+    :param media_type: mime_type файла
+    :param headers: Дополнительные заголовки ответа
+    :param open_range: Функция, открывающая диапазон файла
+    :return: Потоковый ответ 206
+    """
+    headers = {**headers, "Accept-Ranges": "bytes"}
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return StreamingResponse(
+            await open_range(start, end),
+            status_code=206,
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1)
+            }
+        )
+
+    boundary = uuid4().hex
+    part_headers = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    content_length = len(closing) + sum(
+        len(part_header) + end - start + 1 + 2
+        for part_header, (start, end) in zip(part_headers, ranges)
+    )
+
+    async def iter_parts():
+        for part_header, (start, end) in zip(part_headers, ranges):
+            yield part_header
+            async for chunk in await open_range(start, end):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    return StreamingResponse(
+        iter_parts(),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers={**headers, "Content-Length": str(content_length)}
+    )
@@ -0,0 +1,68 @@
+"""
+Пулы соединений с redis для кэша и сессий загрузки.
+Пулы создаются один раз на процесс: асинхронный для API и синхронный для задач селери
+"""
+import asyncio
+import logging
+
+import redis
+from redis import asyncio as aioredis
+from redis.exceptions import LockError
+
+from config import config
+
+redis_pool = aioredis.BlockingConnectionPool(
+    host=config.cache_info.redis_host,
+    port=config.cache_info.redis_port,
+    db=1,
+    max_connections=config.cache_info.max_connections,
+    timeout=config.cache_info.pool_timeout,
+    health_check_interval=config.cache_info.health_check_interval
+)
+
+logger = logging.getLogger(__name__)
+
+sync_redis_pool = redis.BlockingConnectionPool(
+    host=config.cache_info.redis_host,
+    port=config.cache_info.redis_port,
+    db=1,
+    max_connections=config.cache_info.max_connections,
+    timeout=config.cache_info.pool_timeout,
+    health_check_interval=config.cache_info.health_check_interval
+)
+
+
+def get_redis() -> aioredis.Redis:
+    """
+    Отдает асинхронный клиент redis на общем пуле соединений.
+    Закрывать клиент не нужно, соединение возвращается в пул после каждой команды
+    :return: Клиент redis
+    """
+    return aioredis.Redis(connection_pool=redis_pool)
+
+
+def get_sync_redis() -> redis.Redis:
+    """
+    Отдает синхронный клиент redis на общем пуле соединений.
+    После fork пул сам пересоздает соединения в дочернем процессе
+    :return: Клиент redis
+    """
+    return redis.Redis(connection_pool=sync_redis_pool)
+
+
+async def extend_lock(
+        lock
+):
+    """
+    Продлевает блокировку redis, пока держащая ее задача работает.
+    Если реплика упала, блокировка истекает через свой timeout
+    :param lock: Блокировка redis
+    :return:
+    """
+    while True:
+        await asyncio.sleep(lock.timeout / 3)
+        try:
+            await lock.reacquire()
+        except LockError as err:
+            logger.warning("Не удалось продлить блокировку %s: %s", lock.name, err)
+            return
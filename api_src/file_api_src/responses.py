@@ -0,0 +1,90 @@
+"""
+Ответ с файлом, который по возможности отдается без копирования через python
+"""
+import os
+import stat
+from typing import Optional
+
+import anyio
+from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from config import config
+
+
+class SendfileResponse(FileResponse):
+    """
+    FileResponse, который отдает файл через расширения ASGI сервера:
+    http.response.zerocopysend (os.sendfile, в том числе для диапазона)
+    или http.response.pathsend (сервер сам открывает файл, только целиком, например granian).
+    Если сервер их не поддерживает (uvicorn), файл читается кусками download_info.chunk_size вместо 64 KiB.
+    Умеет отдавать один диапазон ответом 206.
+    Если файл стал короче отправленного Content-Length, ответ обрывается ошибкой, а не завершается
+    """
+    chunk_size = config.download_info.chunk_size
+
+    def __init__(
+            self,
+            path: str,
+            content_range: Optional[tuple[int, int]] = None,
+            **kwargs
+    ):
+        """
+        :param path: Путь к файлу
+        :param content_range: Диапазон (начало, конец включительно) для ответа 206.
+        Для диапазона нужно передать stat_result
+        """
+        super().__init__(path, **kwargs)
+        self.content_range = content_range
+
+        if content_range:
+            start, end = content_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{self.stat_result.st_size}"
+            self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            if not stat.S_ISREG(self.stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(self.stat_result)
+
+        start, end = self.content_range or (0, self.stat_result.st_size - 1)
+        extensions = scope.get("extensions") or {}
+
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+
+        if scope["method"].upper() == "HEAD" or start > end:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": start,
+                    "count": end - start + 1,
+                    "more_body": False
+                })
+        elif "http.response.pathsend" in extensions and not self.content_range:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        else:
+            remaining = end - start + 1
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        raise RuntimeError(f"File at path {self.path} is shorter than the sent Content-Length.")
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+        if self.background is not None:
+            await self.background()
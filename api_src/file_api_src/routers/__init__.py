@@ -1,2 +1,3 @@
 from routers.file_router import file_router  # noqa: F401
 from routers.archive_router import archive_router # noqa: F401
+from routers.upload_router import upload_router # noqa: F401
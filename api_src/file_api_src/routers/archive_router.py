@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Query, Response
-from services import  push_archive, get_archive
+from fastapi import APIRouter, Depends, Query, Response
+from services import  push_archive, get_archive, stream_archive
+from storage import get_s3_client
 
 
 archive_router = APIRouter(
@@ -10,11 +11,11 @@ archive_router = APIRouter(
 @archive_router.get("/create_archive")
 async def get_archive_of_folder(
         response: Response, # noqa
-        folder_id: int = Query(...,description="ID папки из которой надо собрать архив"),
+        folder_id: str = Query(...,description="ID папки из которой надо собрать архив"),
 ):
     """
-    Метод для создания архива из папки
-    :param folder_id: int
+    Метод для создания архива из папки со всеми вложенными папками
+    :param folder_id: ID папки
     :return: uuid по которому можно будет скачать архив
     """
     return await push_archive(
@@ -29,3 +30,22 @@ async def get_archive_file(
         archive_id: str = Query(..., description="ID, по которому можно получить архив")
 ):
     return await get_archive(archive_id, response=response)
+
+
+@archive_router.get("/stream_archive")
+async def stream_archive_of_folder(
+        response: Response, # noqa
+        folder_id: str = Query(..., description="ID папки, из которой надо собрать архив"),
+        s3_client=Depends(get_s3_client)
+):
+    """
+    Метод для скачивания архива папки без ожидания его сборки.
+    Архив собирается из s3 во время отдачи, поэтому размер ответа заранее неизвестен
+    :param folder_id: ID папки
+    :return: ZIP архив папки
+    """
+    return await stream_archive(
+        folder_id=folder_id,
+        response=response,
+        s3_client=s3_client
+    )
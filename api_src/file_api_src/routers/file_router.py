@@ -2,20 +2,33 @@
 Роутер для работы с файлами
 """
 
-from fastapi import APIRouter, Depends, Response, Query, BackgroundTasks
+from typing import Optional, Union
+
+from fastapi import APIRouter, Depends, Response, Query, BackgroundTasks, Header
 from starlette.responses import FileResponse
 
 from schemas import (
     FileCreationRequest,
     FileCreationResponse,
+    FilesBatchCreationRequest,
+    FilesBatchCreationResponse,
+    FileByHashCreationRequest,
+    HashCheckRequest,
+    HashCheckResponse,
+    CacheStatsResponse,
     BaseResponse
 )
 from services import (
     upload_file,
+    upload_files,
+    check_hashes,
+    create_file_by_hash,
     remove_file,
     rename_file_in_db,
-    download_file_from_s3
+    download_file_from_s3,
+    get_cache_stats
 )
+from storage import get_s3_client, get_s3_presign_client
 
 file_router = APIRouter(
     prefix="/files"
@@ -26,6 +39,7 @@ file_router = APIRouter(
 async def create_file(
         response: Response, # noqa
         file_info: FileCreationRequest = Depends(FileCreationRequest.as_form),
+        s3_client=Depends(get_s3_client)
 ) -> FileCreationResponse:
     """
     Метод для записи нового файла.
@@ -34,7 +48,51 @@ async def create_file(
     :return: id нового файла или ошибка
     """
 
-    return await upload_file(file_info=file_info, response=response)
+    return await upload_file(file_info=file_info, response=response, s3_client=s3_client)
+
+
+@file_router.post("/create_files")
+async def create_files(
+        response: Response, # noqa
+        files_info: FilesBatchCreationRequest = Depends(FilesBatchCreationRequest.as_form),
+        s3_client=Depends(get_s3_client)
+) -> FilesBatchCreationResponse:
+    """
+    Метод для записи нескольких файлов в одну папку.
+    Загружает файлы на s3 параллельно, записывает данные в базу одной транзакцией
+    :param files_info: Модель с информацией о файлах
+    :return: id новых файлов или ошибки по каждому файлу
+    """
+    return await upload_files(files_info=files_info, response=response, s3_client=s3_client)
+
+
+@file_router.post("/check_hash")
+async def check_hash(
+        response: Response, # noqa
+        hash_info: HashCheckRequest
+) -> HashCheckResponse:
+    """
+    Метод для проверки, какие файлы уже есть в хранилище.
+    Позволяет не отправлять содержимое уже загруженных файлов
+    :param hash_info: Список sha256 хэшей
+    :return: Найденные и не найденные хэши
+    """
+    return await check_hashes(hashes=hash_info.hashes, response=response)
+
+
+@file_router.post("/create_file_by_hash")
+async def create_file_from_hash(
+        response: Response, # noqa
+        file_info: FileByHashCreationRequest,
+        s3_client=Depends(get_s3_client)
+) -> Union[FileCreationResponse, BaseResponse]:
+    """
+    Метод для создания файла по хэшу уже загруженного содержимого.
+    Файл не передается, создается только запись в базе
+    :param file_info: Хэш, имя файла и ID папки
+    :return: id нового файла или ошибка
+    """
+    return await create_file_by_hash(file_info=file_info, response=response, s3_client=s3_client)
 
 
 @file_router.delete("/delete_file")
@@ -73,17 +131,44 @@ async def rename_file(
 async def download_file(
         response: Response, # noqa
         background_tasks: BackgroundTasks, # noqa
-        file_id: str = Query(..., description="ID файла")
+        file_id: str = Query(..., description="ID файла"),
+        range_header: Optional[str] = Header(None, alias="Range", description="Диапазоны байт файла"),
+        if_none_match: Optional[str] = Header(None, alias="If-None-Match", description="ETag уже полученного файла"),
+        if_range: Optional[str] = Header(None, alias="If-Range", description="ETag, при совпадении с которым отдается Range"),
+        s3_client=Depends(get_s3_client),
+        s3_presign_client=Depends(get_s3_presign_client)
 ) -> FileResponse:
     """
-    Метод для скачивания файла
+    Метод для скачивания файла.
+    Поддерживает заголовок Range, в том числе с несколькими диапазонами,
+    и условные запросы по ETag (sha256 файла).
+    В режиме DOWNLOAD_MODE=redirect отвечает 307 на подписанную ссылку s3
     :param file_id: ID файла
-    :return: Файл или ошибка
+    :param range_header: Диапазоны байт файла
+    :param if_none_match: ETag уже полученного файла
+    :param if_range: ETag, при совпадении с которым отдается Range
+    :return: Файл, часть файла, 304 или ошибка
     """
     return await download_file_from_s3(
         file_id=file_id,
         response=response,
-        background_tasks=background_tasks
+        background_tasks=background_tasks,
+        s3_client=s3_client,
+        range_header=range_header,
+        if_none_match=if_none_match,
+        if_range=if_range,
+        s3_presign_client=s3_presign_client
     )
 
 
+
+
+@file_router.get("/cache_stats")
+async def cache_stats(
+        response: Response # noqa
+) -> CacheStatsResponse:
+    """
+    Метод для получения размера локального кэша файлов и доли попаданий в него
+    :return: Статистика кэша
+    """
+    return await get_cache_stats(response=response)
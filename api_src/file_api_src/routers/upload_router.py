@@ -0,0 +1,105 @@
+"""
+Роутер для загрузки больших файлов частями
+"""
+
+from typing import Union
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+
+from schemas import (
+    BaseResponse,
+    FileCreationResponse,
+    UploadSessionCreationRequest,
+    UploadSessionResponse
+)
+from services import (
+    create_upload_session,
+    upload_chunk,
+    get_upload_session,
+    finalize_upload_session,
+    abort_upload_session
+)
+from storage import get_s3_client
+
+upload_router = APIRouter(
+    prefix="/uploads"
+)
+
+
+@upload_router.post("/create_session")
+async def create_session(
+        response: Response, # noqa
+        session_info: UploadSessionCreationRequest,
+        s3_client=Depends(get_s3_client)
+) -> UploadSessionResponse:
+    """
+    Метод для создания сессии загрузки файла частями
+    :param session_info: Имя, размер файла и ID папки
+    :return: ID сессии и размер частей
+    """
+    return await create_upload_session(session_info=session_info, response=response, s3_client=s3_client)
+
+
+@upload_router.put("/upload_chunk")
+async def put_chunk(
+        request: Request,
+        response: Response, # noqa
+        session_id: str = Query(..., description="ID сессии загрузки"),
+        offset: int = Query(..., ge=0, description="Смещение части в файле"),
+        s3_client=Depends(get_s3_client)
+) -> UploadSessionResponse:
+    """
+    Метод для загрузки части файла. Тело запроса - содержимое части.
+    Повторная отправка части с тем же смещением перезаписывает ее
+    :param session_id: ID сессии загрузки
+    :param offset: Смещение части в файле, кратное размеру части
+    :return: Прогресс загрузки
+    """
+    return await upload_chunk(
+        session_id=session_id,
+        offset=offset,
+        request=request,
+        response=response,
+        s3_client=s3_client
+    )
+
+
+@upload_router.get("/session_status")
+async def session_status(
+        response: Response, # noqa
+        session_id: str = Query(..., description="ID сессии загрузки")
+) -> UploadSessionResponse:
+    """
+    Метод для получения прогресса загрузки
+    :param session_id: ID сессии загрузки
+    :return: Полученные байты и смещения недостающих частей
+    """
+    return await get_upload_session(session_id=session_id, response=response)
+
+
+@upload_router.post("/finalize")
+async def finalize_session(
+        response: Response, # noqa
+        session_id: str = Query(..., description="ID сессии загрузки"),
+        s3_client=Depends(get_s3_client)
+) -> Union[FileCreationResponse, UploadSessionResponse]:
+    """
+    Метод для завершения загрузки и создания файла
+    :param session_id: ID сессии загрузки
+    :return: id нового файла или список недостающих частей
+    """
+    return await finalize_upload_session(session_id=session_id, response=response, s3_client=s3_client)
+
+
+@upload_router.delete("/abort_session")
+async def abort_session(
+        response: Response, # noqa
+        session_id: str = Query(..., description="ID сессии загрузки"),
+        s3_client=Depends(get_s3_client)
+) -> BaseResponse:
+    """
+    Метод для отмены загрузки
+    :param session_id: ID сессии загрузки
+    :return: Сообщение об отмене или ошибка
+    """
+    return await abort_upload_session(session_id=session_id, response=response, s3_client=s3_client)
@@ -1,2 +1,16 @@
-from schemas.file_router_requests import FileCreationRequest # noqa
-from schemas.file_router_responses import BaseResponse, FileCreationResponse # noqa
+from schemas.file_router_requests import (
+    FileCreationRequest, # noqa
+    FilesBatchCreationRequest, # noqa
+    HashCheckRequest, # noqa
+    FileByHashCreationRequest # noqa
+)
+from schemas.file_router_responses import (
+    BaseResponse, # noqa
+    FileCreationResponse, # noqa
+    FileBatchItem, # noqa
+    FilesBatchCreationResponse, # noqa
+    HashCheckResponse, # noqa
+    CacheStatsResponse # noqa
+)
+from schemas.upload_router_requests import UploadSessionCreationRequest # noqa
+from schemas.upload_router_responses import UploadSessionResponse # noqa
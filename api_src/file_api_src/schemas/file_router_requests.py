@@ -1,16 +1,42 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
 from fastapi import UploadFile, File, Form
 
 
 class FileCreationRequest(BaseModel):
     file: UploadFile
     folder_id: int
+    file_hash: Optional[str] = None
 
     @classmethod
     def as_form(
             cls,
             file: UploadFile = File(..., description="Данные о загруженном файле"),
             folder_id: int = Form(..., description="ID папки, куда надо загрузить файл"),
+            file_hash: Optional[str] = Form(None, description="sha256 хэш файла, если он известен клиенту"),
+    ):
+        return cls(file=file, folder_id=folder_id, file_hash=file_hash)
+
+
+class FilesBatchCreationRequest(BaseModel):
+    files: list[UploadFile]
+    folder_id: int
+
+    @classmethod
+    def as_form(
+            cls,
+            files: list[UploadFile] = File(..., description="Загруженные файлы"),
+            folder_id: int = Form(..., description="ID папки, куда надо загрузить файлы"),
     ):
-        return cls(file=file, folder_id=folder_id)
+        return cls(files=files, folder_id=folder_id)
+
+
+class HashCheckRequest(BaseModel):
+    hashes: list[str] = Field(..., description="sha256 хэши файлов, которые надо проверить")
+
 
+class FileByHashCreationRequest(BaseModel):
+    file_hash: str = Field(..., description="sha256 хэш уже загруженного файла")
+    file_name: str = Field(..., description="Имя нового файла")
+    folder_id: int = Field(..., description="ID папки, куда надо добавить файл")
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 
@@ -6,3 +8,35 @@ class BaseResponse(BaseModel):
 
 class FileCreationResponse(BaseResponse):
     file_key: str = Field(..., description="ID файла")
+    deduplicated: bool = Field(False, description="Содержимое файла уже было в хранилище")
+    bytes_saved: int = Field(0, description="Сколько байт не пришлось отправлять на s3 благодаря дедупликации")
+
+
+class FileBatchItem(BaseModel):
+    file_name: str = Field(..., description="Имя загруженного файла")
+    file_key: Optional[str] = Field(None, description="ID файла, если он создан")
+    deduplicated: bool = Field(False, description="Содержимое файла уже было в хранилище")
+    error: Optional[str] = Field(None, description="Ошибка при загрузке файла")
+
+
+class FilesBatchCreationResponse(BaseResponse):
+    files: list[FileBatchItem] = Field(..., description="Результат по каждому файлу в порядке загрузки")
+
+
+class HashCheckResponse(BaseResponse):
+    existing: list[str] = Field(..., description="Хэши, которые уже есть в хранилище")
+    missing: list[str] = Field(..., description="Хэши, которых нет в хранилище")
+
+
+class CacheStatsResponse(BaseResponse):
+    size: int = Field(..., description="Размер файлов в кэше в байтах")
+    max_size: int = Field(..., description="Максимальный размер кэша в байтах")
+    files_count: int = Field(..., description="Количество файлов в кэше")
+    hits: int = Field(..., description="Скачиваний, отданных из кэша")
+    misses: int = Field(..., description="Скачиваний, для которых файла не было в кэше")
+    evictions: int = Field(..., description="Файлов, вытесненных из кэша")
+    hit_ratio: float = Field(..., description="Доля скачиваний, отданных из кэша")
+    memory_size: int = Field(..., description="Размер файлов в памяти этого процесса в байтах")
+    memory_files_count: int = Field(..., description="Количество файлов в памяти этого процесса")
+    memory_hits: int = Field(..., description="Скачиваний, отданных из памяти этого процесса")
+    memory_misses: int = Field(..., description="Скачиваний маленьких файлов, которых не было в памяти")
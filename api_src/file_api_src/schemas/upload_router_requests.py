@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+
+
+class UploadSessionCreationRequest(BaseModel):
+    file_name: str = Field(..., description="Имя файла")
+    folder_id: int = Field(..., description="ID папки, куда надо загрузить файл")
+    file_size: int = Field(..., gt=0, description="Размер файла в байтах")
+    content_type: str = Field("application/octet-stream", description="mime_type файла")
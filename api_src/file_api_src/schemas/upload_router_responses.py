@@ -0,0 +1,11 @@
+from pydantic import Field
+
+from schemas.file_router_responses import BaseResponse
+
+
+class UploadSessionResponse(BaseResponse):
+    session_id: str = Field(..., description="ID сессии загрузки")
+    part_size: int = Field(..., description="Размер части, которыми надо отправлять файл")
+    file_size: int = Field(..., description="Размер файла в байтах")
+    received_bytes: int = Field(..., description="Сколько байт уже получено")
+    missing_offsets: list[int] = Field(..., description="Смещения частей, которые еще не получены")
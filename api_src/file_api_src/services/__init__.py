@@ -1,9 +1,20 @@
 from services.file_services import (
     create_archive, # noqa
     upload_file, # noqa
+    upload_files, # noqa
+    check_hashes, # noqa
+    create_file_by_hash, # noqa
     remove_file, # noqa
     push_archive, # noqa
     get_archive, # noqa
-    rename_file_in_db, # noqa
-    download_file_from_s3 # noqa
+    rename_file_in_db # noqa
 )
+from services.download_services import download_file_from_s3, get_cache_stats # noqa
+from services.upload_services import (
+    create_upload_session, # noqa
+    upload_chunk, # noqa
+    get_upload_session, # noqa
+    finalize_upload_session, # noqa
+    abort_upload_session # noqa
+)
+from services.archive_services import stream_archive # noqa
@@ -0,0 +1,71 @@
+"""
+Сервисы для потоковой отдачи архивов папок
+"""
+from typing import AsyncIterator, Union
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from archive_stream import ArchiveEntry, iter_zip
+from config import config
+from database import get_async_session
+from models.file_models import File, FileTree
+from schemas import BaseResponse
+from services.download_services import content_disposition
+from services.file_services import folder_tree_cte
+
+
+async def iter_folder_entries(
+        folder_id: str
+) -> AsyncIterator[ArchiveEntry]:
+    """
+    Отдает файлы всего поддерева папки с путями относительно нее, тем же обходом, что и сборка архива в задаче.
+    Строки читаются серверным курсором пачками archive_info.cursor_size,
+    поэтому сессия базы остается открытой, пока архив отдается клиенту
+    :param folder_id: ID папки
+    :return: Асинхронный генератор файлов архива
+    """
+    folders = folder_tree_cte(folder_id)
+    path = (folders.c.path + File.name).label("path")
+
+    sessionmaker = await get_async_session()
+    async with sessionmaker() as session:
+        result = await session.stream(
+            select(path, File.hash, File.file_size, File.updated_at)
+            .join(folders, File.parent_id == folders.c.id) # noqa
+            .order_by(path)
+            .execution_options(yield_per=config.archive_info.cursor_size)
+        )
+        async for row in result:
+            yield ArchiveEntry(*row)
+
+
+async def stream_archive(
+        folder_id: str,
+        response: Response, # noqa
+        s3_client
+) -> Union[StreamingResponse, BaseResponse]:
+    """
+    Отдает ZIP архив папки, собирая его на лету из s3.
+    Архив не сохраняется ни в ./temp, ни в кэш, в него попадает все поддерево папки.
+    Список файлов читается из базы по мере сборки, поэтому первые байты уходят клиенту сразу
+    :param folder_id: ID папки
+    :param s3_client: Клиент s3
+    :return: Поток архива или ошибка
+    """
+    sessionmaker = await get_async_session()
+    async with sessionmaker() as session:
+        folder_name = (
+            await session.execute(select(FileTree.name).where(FileTree.id == folder_id)) # noqa
+        ).scalar_one_or_none()
+
+        if folder_name is None:
+            response.status_code = 404
+            return BaseResponse(message="Папка не найдена")
+
+    return StreamingResponse(
+        iter_zip(iter_folder_entries(folder_id), s3_client=s3_client),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"{folder_name}.zip")}
+    )
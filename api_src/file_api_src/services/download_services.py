@@ -0,0 +1,633 @@
+"""
+Сервисы для скачивания файлов из кэша и s3
+"""
+import asyncio
+import json
+import os
+import time
+from functools import partial
+from mimetypes import guess_type
+from typing import Optional, Union
+from urllib.parse import quote
+from uuid import uuid4
+
+import anyio
+from fastapi import HTTPException, Response, BackgroundTasks
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+from sqlalchemy import select
+
+from celery_tasks import move_file_to_cache
+from config import config
+from database import get_async_session
+from file_cache import (
+    CACHE_LRU_KEY,
+    CACHE_SIZE_KEY,
+    CACHE_STATS_KEY,
+    blob_cache_key,
+    fetch_lock_key,
+    file_meta_key
+)
+from memory_cache import memory_cache
+from meta_cache import file_meta_cache
+from models.file_models import File
+from redis_pool import extend_lock, get_redis
+from responses import SendfileResponse
+from ranges import (
+    parse_range_header,
+    range_not_satisfiable,
+    ranged_response,
+    open_file_range,
+    open_bytes_range,
+    open_s3_range
+)
+from schemas import BaseResponse, CacheStatsResponse
+from worker import put_file_to_cache
+
+# Хэш -> задача, которая скачивает файл с s3 в кэш.
+# Все запросы процесса к файлу, которого нет в кэше, ждут одну и ту же задачу
+cache_fetches: dict[str, asyncio.Task] = {}
+
+
+def content_disposition(
+        filename: str
+) -> str:
+    """
+    Заголовок Content-Disposition для скачивания файла, так же как в FileResponse
+    :param filename: Имя файла
+    :return: Значение заголовка
+    """
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
+
+
+async def get_file_from_s3(
+        file_hash: str,
+        s3_client
+) -> str:
+    """
+    Скачивает файл из s3 по хэшу
+    :param file_hash: Хэш файла
+    :param s3_client: Клиент s3
+    :return: Путь до файла
+    """
+    path_to_temp_file = f"./temp/{uuid4()}"
+    await s3_client.download_file(
+        config.s3_info.bucket,
+        f"files/{file_hash}",
+        path_to_temp_file
+    )
+    return path_to_temp_file
+
+
+async def iter_s3_object(
+        body,
+        file_id: str,
+        file_meta: dict,
+        cache: bool
+):
+    """
+    Отдает тело объекта s3 частями по мере того, как клиент их забирает.
+    Если включено кэширование, параллельно пишет файл в ./temp
+    и после полного чтения ставит задачу на перенос его в кэш
+    :param body: Тело ответа GetObject
+    :param file_id: ID файла
+    :param file_meta: Хэш, имя и размер файла
+    :param cache: Нужно ли положить файл в кэш
+    :return: Асинхронный генератор частей файла
+    """
+    path_to_temp_file = f"./temp/{uuid4()}" if cache else None
+    temp_file = open(path_to_temp_file, "wb") if cache else None
+    completed = False
+
+    try:
+        async with body:
+            while chunk := await body.read(config.download_info.chunk_size):
+                if temp_file:
+                    await asyncio.to_thread(temp_file.write, chunk)
+                yield chunk
+        completed = True
+    finally:
+        if temp_file:
+            temp_file.close()
+            if not completed:
+                os.remove(path_to_temp_file)
+
+    if temp_file:
+        await asyncio.to_thread(
+            put_file_to_cache.delay,
+            path_to_temp_file,
+            file_meta["file_hash"],
+            file_id,
+            file_meta["file_name"]
+        )
+
+
+async def stream_file_from_s3(
+        file_id: str,
+        file_meta: dict,
+        s3_client,
+        headers: dict[str, str]
+) -> StreamingResponse:
+    """
+    Отдает файл потоком напрямую из s3, не дожидаясь его сохранения на диск
+    :param file_id: ID файла
+    :param file_meta: Хэш, имя и размер файла
+    :param s3_client: Клиент s3
+    :param headers: Дополнительные заголовки ответа
+    :return: Потоковый ответ с файлом
+    """
+    s3_object = await s3_client.get_object(
+        Bucket=config.s3_info.bucket,
+        Key=f"files/{file_meta['file_hash']}"
+    )
+
+    return StreamingResponse(
+        iter_s3_object(
+            body=s3_object["Body"],
+            file_id=file_id,
+            file_meta=file_meta,
+            cache=config.download_info.cache_on_stream
+        ),
+        media_type=guess_type(file_meta["file_name"])[0] or "text/plain",
+        headers={
+            **headers,
+            "Content-Disposition": content_disposition(file_meta["file_name"]),
+            "Content-Length": str(s3_object["ContentLength"]),
+            "Accept-Ranges": "bytes"
+        }
+    )
+
+
+def make_etag(
+        file_hash: str
+) -> str:
+    """
+    Сильный ETag файла. Содержимое адресуется sha256, поэтому хэш и есть версия файла
+    :param file_hash: Хэш файла
+    :return: Значение заголовка ETag
+    """
+    return f'"{file_hash}"'
+
+
+def etag_matches(
+        header: str,
+        etag: str,
+        weak: bool = True
+) -> bool:
+    """
+    Сравнивает ETag со значением If-None-Match или If-Range
+    :param header: Значение заголовка
+    :param etag: ETag файла
+    :param weak: Слабое сравнение (для If-None-Match), при сильном W/ теги не совпадают
+    :return: True, если ETag совпал
+    """
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" and weak:
+            return True
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+async def presigned_redirect(
+        file_hash: str,
+        file_name: str,
+        s3_presign_client,
+        headers: dict[str, str]
+) -> RedirectResponse:
+    """
+    Перенаправляет клиента на короткоживущую подписанную ссылку s3,
+    чтобы содержимое файла не проходило через API.
+    Имя файла и mime_type передаются в s3 через параметры ссылки
+    :param file_hash: Хэш файла
+    :param file_name: Имя файла
+    :param s3_presign_client: Клиент s3 с публичным адресом
+    :param headers: Дополнительные заголовки ответа
+    :return: Ответ 307 со ссылкой на файл
+    """
+    url = await s3_presign_client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": config.s3_info.bucket,
+            "Key": f"files/{file_hash}",
+            "ResponseContentDisposition": content_disposition(file_name),
+            "ResponseContentType": guess_type(file_name)[0] or "text/plain"
+        },
+        ExpiresIn=config.download_info.presigned_url_ttl
+    )
+
+    # Ссылка перестанет работать через presigned_url_ttl, поэтому сам редирект не кэшируется
+    return RedirectResponse(url, status_code=307, headers={**headers, "Cache-Control": "no-store"})
+
+
+async def get_file_meta(
+        r: Redis,
+        file_id: str
+) -> Optional[dict]:
+    """
+    Отдает хэш, имя и размер файла по ID.
+    Сначала смотрит в памяти процесса, затем в redis,
+    при промахе берет запись из базы и сохраняет ее в redis
+    :param r: Клиент redis
+    :param file_id: ID файла
+    :return: Метаданные файла или None, если файла нет
+    """
+    if file_meta := file_meta_cache.get(file_id):
+        return file_meta
+
+    file_meta = await r.get(file_meta_key(file_id))
+    if file_meta:
+        file_meta = json.loads(file_meta)
+        file_meta_cache.put(file_id, file_meta)
+        return file_meta
+
+    sessionmaker = await get_async_session()
+    async with sessionmaker() as session:
+        result = await session.execute(
+            select(File.hash, File.name, File.file_size)
+            .where(File.id == file_id) # noqa
+        )
+        row = result.one_or_none()
+
+    if not row:
+        return None
+
+    file_meta = {"file_hash": row.hash, "file_name": row.name, "file_size": row.file_size}
+    await r.set(file_meta_key(file_id), json.dumps(file_meta), ex=config.cache_info.ttl)
+    file_meta_cache.put(file_id, file_meta)
+    return file_meta
+
+
+async def lookup_cached_path(
+        r: Redis,
+        file_hash: str
+) -> Optional[str]:
+    """
+    Ищет файл в локальном кэше, не учитывая обращение в статистике
+    :param r: Клиент redis
+    :param file_hash: Хэш файла
+    :return: Путь к файлу или None, если файла нет в кэше
+    """
+    cache_info = await r.get(blob_cache_key(file_hash))
+    if not cache_info:
+        return None
+
+    path_to_cache = json.loads(cache_info)["path_to_cache"]
+    if not os.path.exists(path_to_cache):
+        return None
+    return path_to_cache
+
+
+async def get_cached_path(
+        r: Redis,
+        file_hash: str
+) -> Optional[str]:
+    """
+    Отдает путь к файлу в локальном кэше по хэшу содержимого.
+    Попадание обновляет время обращения к файлу в индексе LRU,
+    попадания и промахи считаются в статистике кэша
+    :param r: Клиент redis
+    :param file_hash: Хэш файла
+    :return: Путь к файлу или None, если файла нет в кэше
+    """
+    path_to_cache = await lookup_cached_path(r, file_hash)
+
+    if not path_to_cache:
+        await r.hincrby(CACHE_STATS_KEY, "misses", 1)
+        return None
+
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.zadd(CACHE_LRU_KEY, {file_hash: time.time()}, xx=True)
+        pipe.hincrby(CACHE_STATS_KEY, "hits", 1)
+        await pipe.execute()
+    return path_to_cache
+
+
+async def fetch_file_to_cache_once(
+        file_hash: str,
+        file_id: str,
+        file_name: str,
+        s3_client
+) -> Optional[str]:
+    """
+    Скачивает файл с s3 и кладет его в кэш.
+    Между репликами скачивание согласуется блокировкой в redis:
+    пока файл качает другая реплика, задача ждет его появления в кэше.
+    Блокировка продлевается все время скачивания, поэтому ожидание заканчивается,
+    только когда файл появился в кэше или реплика, которая его качала, перестала продлевать блокировку
+    :param file_hash: Хэш файла
+    :param file_id: ID файла
+    :param file_name: Имя файла
+    :param s3_client: Клиент s3
+    :return: Путь к файлу в кэше или None, если файл не поместился в кэш
+    """
+    r = get_redis()
+    lock = r.lock(fetch_lock_key(file_hash), timeout=config.cache_info.fetch_lock_timeout)
+    try:
+        while not await lock.acquire(blocking=False):
+            if path_to_cache := await lookup_cached_path(r, file_hash):
+                return path_to_cache
+            await asyncio.sleep(0.2)
+
+        if path_to_cache := await lookup_cached_path(r, file_hash):
+            return path_to_cache
+
+        lock_extension = asyncio.create_task(extend_lock(lock))
+        try:
+            path_to_file = await get_file_from_s3(file_hash, s3_client=s3_client)
+            return await asyncio.to_thread(move_file_to_cache, path_to_file, file_hash, file_id, file_name)
+        finally:
+            lock_extension.cancel()
+    finally:
+        try:
+            await lock.release()
+        except LockError:
+            pass
+
+
+async def fetch_file_to_cache(
+        file_hash: str,
+        file_id: str,
+        file_name: str,
+        s3_client
+) -> Optional[str]:
+    """
+    Скачивает файл с s3 в кэш, объединяя одновременные запросы к одному содержимому:
+    на все запросы процесса выполняется одно скачивание.
+    Отключение клиента не отменяет скачивание, которое ждут другие запросы
+    :param file_hash: Хэш файла
+    :param file_id: ID файла
+    :param file_name: Имя файла
+    :param s3_client: Клиент s3
+    :return: Путь к файлу в кэше или None, если файл не поместился в кэш
+    """
+    task = cache_fetches.get(file_hash)
+    if not task:
+        task = asyncio.create_task(fetch_file_to_cache_once(file_hash, file_id, file_name, s3_client))
+        cache_fetches[file_hash] = task
+        task.add_done_callback(lambda _: cache_fetches.pop(file_hash, None))
+    return await asyncio.shield(task)
+
+
+async def get_cache_stats(
+        response: Response # noqa
+) -> CacheStatsResponse:
+    """
+    Отдает размер локального кэша и статистику обращений к нему
+    :return: Статистика кэша
+    """
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.get(CACHE_SIZE_KEY)
+        pipe.zcard(CACHE_LRU_KEY)
+        pipe.hgetall(CACHE_STATS_KEY)
+        cache_size, files_count, stats = await pipe.execute()
+
+    hits = int(stats.get(b"hits", 0))
+    misses = int(stats.get(b"misses", 0))
+
+    response.status_code = 200
+    return CacheStatsResponse(
+        message="Статистика кэша",
+        size=int(cache_size or 0),
+        max_size=config.cache_info.max_size,
+        files_count=files_count,
+        hits=hits,
+        misses=misses,
+        evictions=int(stats.get(b"evictions", 0)),
+        hit_ratio=hits / (hits + misses) if hits + misses else 0.0,
+        memory_size=memory_cache.size,
+        memory_files_count=len(memory_cache),
+        memory_hits=memory_cache.hits,
+        memory_misses=memory_cache.misses
+    )
+
+
+async def load_small_file(
+        r: Redis,
+        file_id: str,
+        file_meta: dict,
+        s3_client
+) -> bytes:
+    """
+    Читает маленький файл из кэша на диске или из s3 и кладет его в память процесса
+    :param r: Клиент redis
+    :param file_id: ID файла
+    :param file_meta: Хэш, имя и размер файла
+    :param s3_client: Клиент s3
+    :return: Содержимое файла
+    """
+    file_hash = file_meta["file_hash"]
+
+    path_to_cache = await get_cached_path(r, file_hash)
+    if not path_to_cache and config.download_info.mode != "stream":
+        path_to_cache = await fetch_file_to_cache(file_hash, file_id, file_meta["file_name"], s3_client=s3_client)
+
+    if path_to_cache:
+        async with await anyio.open_file(path_to_cache, mode="rb") as file:
+            data = await file.read()
+    else:
+        s3_object = await s3_client.get_object(Bucket=config.s3_info.bucket, Key=f"files/{file_hash}")
+        async with s3_object["Body"] as body:
+            data = await body.read()
+
+    memory_cache.put(file_hash, data)
+    return data
+
+
+async def memory_file_response(
+        data: bytes,
+        file_name: str,
+        headers: dict[str, str],
+        range_header: Optional[str]
+) -> Response:
+    """
+    Отдает файл из памяти целиком или запрошенными диапазонами
+    :param data: Содержимое файла
+    :param file_name: Имя файла
+    :param headers: Дополнительные заголовки ответа
+    :param range_header: Значение заголовка Range
+    :return: Файл или его часть
+    """
+    media_type = guess_type(file_name)[0] or "text/plain"
+    headers = {**headers, "Content-Disposition": content_disposition(file_name)}
+
+    if range_header:
+        ranges = parse_range_header(range_header, len(data))
+        if ranges == []:
+            return range_not_satisfiable(len(data))
+        if ranges:
+            return await ranged_response(
+                ranges=ranges,
+                size=len(data),
+                media_type=media_type,
+                headers=headers,
+                open_range=partial(open_bytes_range, data)
+            )
+
+    return Response(content=data, media_type=media_type, headers={**headers, "Accept-Ranges": "bytes"})
+
+
+async def download_file_from_s3(
+        file_id: str,
+        response: Response, # noqa
+        background_tasks: BackgroundTasks, # noqa
+        s3_client,
+        range_header: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+        if_range: Optional[str] = None,
+        s3_presign_client=None
+) -> Union[FileResponse, StreamingResponse, RedirectResponse, Response, BaseResponse]:
+    """
+    Отдает файл из хранилища либо их кэша.
+    Кэш хранит файлы по хэшу, поэтому файлы с одинаковым содержимым используют одну копию.
+    Маленькие файлы отдаются из памяти процесса, без обращения к диску и s3.
+    Файлы с диска отдаются через SendfileResponse, без копирования через python,
+    если ASGI сервер это поддерживает.
+    В режиме file одновременные запросы к файлу, которого нет в кэше,
+    ждут одно скачивание с s3 в кэш, в том числе на разных репликах.
+    В режиме stream файл, которого нет в кэше, отдается потоком из s3.
+    В режиме redirect API только находит файл в базе и отвечает 307
+    с подписанной ссылкой на s3, Range и остальное обрабатывает s3.
+    Если передан заголовок Range, отдаются только запрошенные диапазоны:
+    из файла в кэше, а если его нет, то ranged запросом к s3.
+    ETag файла - его sha256, поэтому If-None-Match и If-Range
+    проверяются только по метаданным, без обращения к s3 и к диску
+    :param file_id: ID файла
+    :param range_header: Значение заголовка Range
+    :param if_none_match: Значение заголовка If-None-Match
+    :param if_range: Значение заголовка If-Range
+    :param s3_presign_client: Клиент s3 для подписи ссылок в режиме redirect
+    :return: Файл или сообщение об ошибке
+    """
+    try:
+        r = get_redis()
+        file_meta = await get_file_meta(r, file_id)
+
+        if not file_meta:
+            response.status_code = 404
+            return BaseResponse(message="Файл не найден")
+
+        file_hash = file_meta["file_hash"]
+        file_name = file_meta["file_name"]
+
+        headers = {
+            "ETag": make_etag(file_hash),
+            "Cache-Control": config.download_info.cache_control
+        }
+
+        if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        if config.download_info.mode == "redirect":
+            return await presigned_redirect(file_hash, file_name, s3_presign_client, headers=headers)
+
+        if if_range and not etag_matches(if_range, headers["ETag"], weak=False):
+            range_header = None
+
+        if memory_cache.accepts(file_meta["file_size"]):
+            data = memory_cache.get(file_hash)
+            if data is None:
+                try:
+                    data = await load_small_file(r, file_id, file_meta, s3_client=s3_client)
+                except Exception as err:
+                    response.status_code = 404
+                    return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
+
+            return await memory_file_response(data, file_name, headers=headers, range_header=range_header)
+
+        path_to_cache = await get_cached_path(r, file_hash)
+
+        if path_to_cache:
+            stat_result = os.stat(path_to_cache)
+
+            if range_header:
+                ranges = parse_range_header(range_header, stat_result.st_size)
+                if ranges == []:
+                    return range_not_satisfiable(stat_result.st_size)
+                if ranges and len(ranges) == 1:
+                    return SendfileResponse(
+                        path=path_to_cache,
+                        content_range=ranges[0],
+                        filename=file_name,
+                        stat_result=stat_result,
+                        headers={**headers, "Accept-Ranges": "bytes"}
+                    )
+                if ranges:
+                    return await ranged_response(
+                        ranges=ranges,
+                        size=stat_result.st_size,
+                        media_type=guess_type(file_name)[0] or "text/plain",
+                        headers={**headers, "Content-Disposition": content_disposition(file_name)},
+                        open_range=partial(open_file_range, path_to_cache)
+                    )
+
+            return SendfileResponse(
+                path=path_to_cache,
+                filename=file_name,
+                stat_result=stat_result,
+                headers={**headers, "Accept-Ranges": "bytes"}
+            )
+
+        if range_header:
+            ranges = parse_range_header(range_header, file_meta["file_size"])
+            if ranges == []:
+                return range_not_satisfiable(file_meta["file_size"])
+            if ranges:
+                try:
+                    return await ranged_response(
+                        ranges=ranges,
+                        size=file_meta["file_size"],
+                        media_type=guess_type(file_name)[0] or "text/plain",
+                        headers={**headers, "Content-Disposition": content_disposition(file_name)},
+                        open_range=partial(open_s3_range, s3_client, f"files/{file_hash}")
+                    )
+                except Exception as err:
+                    response.status_code = 404
+                    return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
+
+        if config.download_info.mode == "stream":
+            try:
+                return await stream_file_from_s3(file_id, file_meta, s3_client=s3_client, headers=headers)
+            except Exception as err:
+                response.status_code = 404
+                return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
+
+        if file_meta["file_size"] <= config.cache_info.max_size:
+            try:
+                path_to_cache = await fetch_file_to_cache(file_hash, file_id, file_name, s3_client=s3_client)
+            except Exception as err:
+                response.status_code = 404
+                return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
+
+            if path_to_cache:
+                return SendfileResponse(
+                    path=path_to_cache,
+                    filename=file_name,
+                    headers={**headers, "Accept-Ranges": "bytes"}
+                )
+
+        try:
+            path_to_file = await get_file_from_s3(file_hash, s3_client=s3_client)
+        except Exception as err:
+            response.status_code = 404
+            return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
+
+        response.status_code = 200
+        background_tasks.add_task(put_file_to_cache.delay, path_to_file, file_hash, file_id, file_name)
+        return SendfileResponse(
+            path=path_to_file,
+            filename=file_name,
+            headers={**headers, "Accept-Ranges": "bytes"}
+        )
+
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=f"При скачивании файла произошла ошибка {err}")
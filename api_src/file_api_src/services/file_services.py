@@ -1,33 +1,53 @@
-import json
+import asyncio
+import logging
+import os
+from datetime import timedelta
 from hashlib import sha256
-from typing import Union
+from typing import Optional, Union
 from uuid import uuid4
 
-import aioboto3
-from fastapi import UploadFile, HTTPException, Response, BackgroundTasks
+from fastapi import UploadFile, HTTPException, Response
 from fastapi.responses import FileResponse
-from redis.asyncio import Redis
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, insert, func, or_, and_, all_, literal_column
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import array, insert as pg_insert
 
 from config import config
 from database import get_async_session
+from file_cache import file_meta_key
+from hashing import update_hash, choose_chunk_size
+from meta_cache import publish_file_meta_invalidation
 from models.file_models import FileHash, File, ArchiveRequest, FileTree
-from schemas import FileCreationRequest, BaseResponse, FileCreationResponse
-from worker import create_archive, put_file_to_cache
+from redis_pool import get_redis
+from schemas import (
+    FileCreationRequest,
+    FilesBatchCreationRequest,
+    FileByHashCreationRequest,
+    BaseResponse,
+    FileCreationResponse,
+    FileBatchItem,
+    FilesBatchCreationResponse,
+    HashCheckResponse
+)
+from worker import create_archive
+
+logger = logging.getLogger(__name__)
 
 
 async def calculate_hash(
         file: UploadFile
 ):
     """
-    Рассчитывает sha256 хэш файла
+    Рассчитывает sha256 хэш файла.
+    Размер чтения зависит от размера файла, хэш считается вне event loop
     :param file: Загруженный файл
     :return: sha256 хэш
     """
     sha256_hash = sha256()
+    chunk_size = choose_chunk_size(file.size)
 
-    while content := await file.read(config.file_chunk):
-        sha256_hash.update(content)
+    while content := await file.read(chunk_size):
+        await update_hash(sha256_hash, content)
 
     return sha256_hash.hexdigest()
 
@@ -37,143 +57,499 @@ async def add_file_to_db(
         file_size: int,
         file_hash: str,
         folder_id: int,
-        created_by: str
-):
+        created_by: str,
+        content_type: Optional[str] = None
+) -> str:
     """
-    Создает новую запись в app.files
+    Создает новую запись в app.files одним запросом.
+    В том же запросе через CTE создается запись в app.files_hashes (ON CONFLICT DO NOTHING),
+    поэтому одновременная загрузка одинаковых файлов не приводит к ошибке,
+    а запись хэша, которой еще нет, не нарушает внешний ключ
     :param filename: Имя файла
     :param file_size: Размер файла
     :param file_hash: Хэш файла
     :param folder_id: ID папки
     :param created_by: Имя пользователя
+    :param content_type: mime_type файла, если записи хэша еще нет. Если не передан - application/octet-stream
     :return: Id новой записи в app.files
     """
-    try:
-        file_obj = File(
+    statement = (
+        insert(File)
+        .values(
             name=filename,
             file_size=file_size,
             hash=file_hash,
             parent_id=folder_id,
             created_by=created_by
         )
+        .returning(File.id)
+        .add_cte(
+            pg_insert(FileHash)
+            .values(id=file_hash, mime_type=content_type or "application/octet-stream")
+            .on_conflict_do_nothing(index_elements=[FileHash.id])
+            .cte("new_file_hash")
+        )
+    )
 
+    try:
         sessionmaker = await get_async_session()
         async with sessionmaker() as session, session.begin():
-            session.add(file_obj)
-            await session.commit()
-        return str(file_obj.id)
+            result = await session.execute(statement)
+            return str(result.scalar_one())
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"При записи файла в базу произошла ошибка {err}")
 
 
+async def file_hash_exists(
+        file_hash: str
+) -> bool:
+    """
+    Проверяет, есть ли уже файл с таким хэшем в app.files_hashes
+    :param file_hash: Хэш файла
+    :return: True, если содержимое уже хранится на s3
+    """
+    sessionmaker = await get_async_session()
+    async with sessionmaker() as session:
+        result = await session.execute(
+            select(FileHash.id)
+            .where(FileHash.id == file_hash) # noqa
+        )
+        return result.scalar() is not None
 
-async def add_file_hash_to_db(
-        file_hash: str,
-        content_type: str
+
+S3_MAX_COPY_SIZE = 1024 * 1024 * 1024 * 5  # Ограничение s3 на copy_object одним запросом
+
+
+async def copy_s3_object(
+        s3_client,
+        source_key: str,
+        target_key: str,
+        object_size: int
 ):
     """
-    Создает новую запись в app.files_hashes
-    :param file_hash: Хэш файла
-    :param content_type: mime_type файла
+    Копирует объект внутри бакета на стороне s3.
+    Объекты больше 5 GiB копируются через multipart upload_part_copy
+    :param s3_client: Клиент s3
+    :param source_key: Ключ исходного объекта
+    :param target_key: Ключ нового объекта
+    :param object_size: Размер объекта
     :return:
     """
+    copy_source = {"Bucket": config.s3_info.bucket, "Key": source_key}
+
+    if object_size <= S3_MAX_COPY_SIZE:
+        await s3_client.copy_object(
+            Bucket=config.s3_info.bucket,
+            Key=target_key,
+            CopySource=copy_source
+        )
+        return
+
+    multipart = await s3_client.create_multipart_upload(
+        Bucket=config.s3_info.bucket,
+        Key=target_key
+    )
+    upload_id = multipart["UploadId"]
+    parts = []
     try:
-        sessionmaker = await get_async_session()
-        async with sessionmaker() as session, session.begin():
-            result = await session.execute(
-                select(FileHash)
-                .where(FileHash.id == file_hash) # noqa
+        for part_number, start in enumerate(range(0, object_size, S3_MAX_COPY_SIZE), start=1):
+            end = min(start + S3_MAX_COPY_SIZE, object_size) - 1
+            part = await s3_client.upload_part_copy(
+                Bucket=config.s3_info.bucket,
+                Key=target_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                CopySource=copy_source,
+                CopySourceRange=f"bytes={start}-{end}"
             )
+            parts.append({"ETag": part["CopyPartResult"]["ETag"], "PartNumber": part_number})
 
-            if not result.scalar():
-                file_hash_obj = FileHash(id=file_hash, mime_type=content_type)
-                session.add(file_hash_obj)
-                await session.commit()
-    except Exception as err:
-        raise HTTPException(status_code=500, detail=f"При записи хэша в базу произошла ошибка {err}")
+        await s3_client.complete_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=target_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        await s3_client.abort_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=target_key,
+            UploadId=upload_id
+        )
+        raise
 
 
-async def upload_file_to_s3(
+async def iter_file_parts(
         file: UploadFile,
-        file_key: str
+        head: bytes
 ):
     """
-    Загружает файл на s3 хранилище
+    Делит файл на части размером config.s3_info.part_size для multipart загрузки.
+    Все части, кроме последней, имеют полный размер
     :param file: Загруженный файл
-    :param file_key: Ключ файла
-    :return:
+    :param head: Уже прочитанное начало файла
+    :return: Асинхронный генератор частей файла
     """
-    s3_session = aioboto3.Session()
-
-    async with s3_session.client(
-        "s3",
-        endpoint_url=config.s3_info.endpoint,
-        aws_access_key_id=config.s3_info.access_key,
-        aws_secret_access_key=config.s3_info.secret_key
-    ) as client:
-        await client.upload_fileobj(
-            file.file,
-            config.s3_info.bucket,
-            f"files/{file_key}"
-        )
+    part_size = config.s3_info.part_size
+    tail_start = len(head) - len(head) % part_size
 
+    for start in range(0, tail_start, part_size):
+        yield head[start:start + part_size]
 
-async def get_file_from_s3(
-        file_hash: str
-) -> str:
+    part = head[tail_start:] + await file.read(part_size - (len(head) - tail_start))
+    while part:
+        yield part
+        part = await file.read(part_size)
+
+
+async def upload_file_to_s3(
+        file: UploadFile,
+        s3_client
+) -> tuple[str, int, bool]:
     """
-    Скачивает файл из s3 по хэшу
-    :param file_hash: Хэш файла
-    :return: Путь до файла
-    """
-    path_to_temp_file = f"./temp/{uuid4()}"
-    s3_session = aioboto3.Session()
-    async with s3_session.client(
-            "s3",
-            endpoint_url=config.s3_info.endpoint,
-            aws_access_key_id=config.s3_info.access_key,
-            aws_secret_access_key=config.s3_info.secret_key
-    ) as client:
-        await client.download_file(
-            config.s3_info.bucket,
-            f"files/{file_hash}",
-            path_to_temp_file
+    Загружает файл на s3 хранилище за один проход по файлу, одновременно считая sha256 хэш.
+    Файл меньше config.s3_info.multipart_threshold загружается сразу под ключом files/{hash},
+    если такого хэша еще нет в базе.
+    Большой файл загружается через multipart под временным ключом,
+    части отправляются параллельно, но не больше config.s3_info.max_concurrency одновременно,
+    после чего файл копируется на стороне s3 под ключ files/{hash}.
+    Если хэш уже есть в базе, multipart загрузка отменяется без копирования
+    :param file: Загруженный файл
+    :param s3_client: Клиент s3
+    :return: sha256 хэш, размер файла и признак того, что содержимое уже было на s3
+    """
+    sha256_hash = sha256()
+    head = await file.read(config.s3_info.multipart_threshold)
+
+    if len(head) < config.s3_info.multipart_threshold:
+        await update_hash(sha256_hash, head)
+        file_hash = sha256_hash.hexdigest()
+        if await file_hash_exists(file_hash):
+            return file_hash, len(head), True
+
+        await s3_client.put_object(
+            Bucket=config.s3_info.bucket,
+            Key=f"files/{file_hash}",
+            Body=head
         )
-    return path_to_temp_file
+        return file_hash, len(head), False
+
+    temp_key = f"temp/{uuid4()}"
+    multipart = await s3_client.create_multipart_upload(
+        Bucket=config.s3_info.bucket,
+        Key=temp_key
+    )
+    upload_id = multipart["UploadId"]
+    semaphore = asyncio.Semaphore(config.s3_info.max_concurrency)
+
+    async def upload_part(part_number: int, body: bytes) -> dict:
+        try:
+            part = await s3_client.upload_part(
+                Bucket=config.s3_info.bucket,
+                Key=temp_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {"ETag": part["ETag"], "PartNumber": part_number}
+        finally:
+            semaphore.release()
+
+    file_size = 0
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = []
+            async for body in iter_file_parts(file=file, head=head):
+                await semaphore.acquire()
+                await update_hash(sha256_hash, body)
+                file_size += len(body)
+                tasks.append(task_group.create_task(upload_part(len(tasks) + 1, body)))
+
+        file_hash = sha256_hash.hexdigest()
+        deduplicated = await file_hash_exists(file_hash)
+
+        if not deduplicated:
+            await s3_client.complete_multipart_upload(
+                Bucket=config.s3_info.bucket,
+                Key=temp_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [task.result() for task in tasks]}
+            )
+    except Exception:
+        await s3_client.abort_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=temp_key,
+            UploadId=upload_id
+        )
+        raise
+
+    if deduplicated:
+        await s3_client.abort_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=temp_key,
+            UploadId=upload_id
+        )
+        return file_hash, file_size, True
+
+    try:
+        await copy_s3_object(
+            s3_client=s3_client,
+            source_key=temp_key,
+            target_key=f"files/{file_hash}",
+            object_size=file_size
+        )
+    finally:
+        await s3_client.delete_object(Bucket=config.s3_info.bucket, Key=temp_key)
+
+    return file_hash, file_size, False
 
 
 async def upload_file(
         file_info: FileCreationRequest,
-        response: Response # noqa
+        response: Response, # noqa
+        s3_client
 ) -> FileCreationResponse:
     """
-    Контроллер создания нового файла
+    Контроллер создания нового файла.
+    Если клиент передал хэш, который уже есть в базе, и он совпадает с хэшем файла,
+    файл не отправляется на s3, создается только запись в app.files.
+    Без такого хэша файл читается один раз: хэш считается во время загрузки на s3
     :param file_info: Информация о файле
     :return: ID нового файла или ошибка
     """
-    file_hash = await calculate_hash(file=file_info.file)
-    await file_info.file.seek(0)
-
-    await upload_file_to_s3(
-        file=file_info.file,
-        file_key=file_hash
-    )
+    file_hash = None
+    file_size = file_info.file.size
+    deduplicated = False
+    bytes_saved = 0
+
+    if file_info.file_hash and await file_hash_exists(file_info.file_hash):
+        file_hash = await calculate_hash(file=file_info.file)
+        if file_hash == file_info.file_hash:
+            deduplicated = True
+            bytes_saved = file_size
+        else:
+            await file_info.file.seek(0)
+
+    if not deduplicated:
+        file_hash, file_size, deduplicated = await upload_file_to_s3(
+            file=file_info.file,
+            s3_client=s3_client
+        )
+        # Большой файл отправляется на s3 за тот же проход, что и хэшируется,
+        # поэтому совпадение с уже загруженным содержимым экономит только копирование
+        if deduplicated and file_size < config.s3_info.multipart_threshold:
+            bytes_saved = file_size
+
+    if deduplicated:
+        logger.info(
+            "Файл %s совпал с уже загруженным %s, не отправлено на s3 %s байт",
+            file_info.file.filename, file_hash, bytes_saved
+        )
 
-    await add_file_hash_to_db(
+    file_id = await add_file_to_db(
+        filename=file_info.file.filename,
+        file_size=file_size,
         file_hash=file_hash,
+        folder_id=file_info.folder_id,
+        created_by="admin",
         content_type=file_info.file.content_type
     )
 
+    response.status_code = 201
+    return FileCreationResponse(
+        message="Файл создан",
+        file_key=file_id,
+        deduplicated=deduplicated,
+        bytes_saved=bytes_saved
+    )
+
+
+async def upload_files(
+        files_info: FilesBatchCreationRequest,
+        response: Response, # noqa
+        s3_client
+) -> FilesBatchCreationResponse:
+    """
+    Контроллер создания нескольких файлов за один запрос.
+    Файлы хэшируются и загружаются на s3 параллельно,
+    но не больше config.s3_info.batch_concurrency одновременно.
+    Все записи в app.files_hashes и app.files создаются в одной транзакции
+    :param files_info: Информация о файлах
+    :return: ID новых файлов или ошибки по каждому файлу
+    """
+    semaphore = asyncio.Semaphore(config.s3_info.batch_concurrency)
+
+    async def store_file(file: UploadFile) -> tuple[str, int, bool]:
+        async with semaphore:
+            return await upload_file_to_s3(file=file, s3_client=s3_client)
+
+    results = await asyncio.gather(
+        *(store_file(file) for file in files_info.files),
+        return_exceptions=True
+    )
+
+    items = [FileBatchItem(file_name=file.filename) for file in files_info.files]
+    hashes_rows = {}
+    files_rows = []
+    stored_items = []
+
+    for file, item, result in zip(files_info.files, items, results):
+        if isinstance(result, BaseException):
+            logger.error("При загрузке файла %s на s3 произошла ошибка %s", file.filename, result)
+            item.error = f"При загрузке файла на s3 произошла ошибка {result}"
+            continue
+
+        file_hash, file_size, item.deduplicated = result
+        hashes_rows.setdefault(file_hash, {"id": file_hash, "mime_type": file.content_type})
+        files_rows.append({
+            "name": file.filename,
+            "file_size": file_size,
+            "hash": file_hash,
+            "parent_id": files_info.folder_id,
+            "created_by": "admin"
+        })
+        stored_items.append(item)
+
+    if files_rows:
+        try:
+            sessionmaker = await get_async_session()
+            async with sessionmaker() as session, session.begin():
+                await session.execute(
+                    pg_insert(FileHash)
+                    .values(list(hashes_rows.values()))
+                    .on_conflict_do_nothing(index_elements=[FileHash.id])
+                )
+                result = await session.execute(
+                    insert(File).returning(File.id, sort_by_parameter_order=True),
+                    files_rows
+                )
+                for item, file_id in zip(stored_items, result.scalars().all()):
+                    item.file_key = str(file_id)
+        except Exception as err:
+            raise HTTPException(status_code=500, detail=f"При записи файлов в базу произошла ошибка {err}")
+
+    deduplicated_count = sum(item.deduplicated for item in stored_items)
+    if deduplicated_count:
+        logger.info("При пакетной загрузке %s из %s файлов уже были в хранилище", deduplicated_count, len(items))
+
+    response.status_code = 201 if stored_items else 400
+    return FilesBatchCreationResponse(
+        message=f"Создано файлов: {len(stored_items)} из {len(items)}",
+        files=items
+    )
+
+
+async def check_hashes(
+        hashes: list[str],
+        response: Response # noqa
+) -> HashCheckResponse:
+    """
+    Контроллер проверки хэшей.
+    Позволяет клиенту узнать, какие файлы уже есть в хранилище, до отправки их содержимого
+    :param hashes: sha256 хэши файлов
+    :return: Списки найденных и не найденных хэшей
+    """
+    try:
+        sessionmaker = await get_async_session()
+        async with sessionmaker() as session:
+            result = await session.execute(
+                select(FileHash.id)
+                .where(FileHash.id.in_(set(hashes)))
+            )
+            existing = set(result.scalars().all())
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=f"При проверке хэшей произошла ошибка {err}")
+
+    response.status_code = 200
+    return HashCheckResponse(
+        message="Хэши проверены",
+        existing=[file_hash for file_hash in hashes if file_hash in existing],
+        missing=[file_hash for file_hash in hashes if file_hash not in existing]
+    )
+
+
+async def get_size_by_hash(
+        file_hash: str,
+        s3_client
+) -> int:
+    """
+    Возвращает размер содержимого по хэшу.
+    Берет размер у любого файла с этим хэшем, а если таких нет, то у объекта на s3
+    :param file_hash: Хэш файла
+    :param s3_client: Клиент s3
+    :return: Размер файла
+    """
+    sessionmaker = await get_async_session()
+    async with sessionmaker() as session:
+        result = await session.execute(
+            select(File.file_size)
+            .where(File.hash == file_hash) # noqa
+            .limit(1)
+        )
+        file_size = result.scalar()
+
+    if file_size is not None:
+        return file_size
+
+    head = await s3_client.head_object(
+        Bucket=config.s3_info.bucket,
+        Key=f"files/{file_hash}"
+    )
+    return head["ContentLength"]
+
+
+async def create_file_by_hash(
+        file_info: FileByHashCreationRequest,
+        response: Response, # noqa
+        s3_client
+) -> Union[FileCreationResponse, BaseResponse]:
+    """
+    Контроллер создания файла по хэшу уже загруженного содержимого, без передачи самого файла
+    :param file_info: Информация о файле
+    :return: ID нового файла или ошибка
+    """
+    if not await file_hash_exists(file_info.file_hash):
+        response.status_code = 404
+        return BaseResponse(message="Файл с таким хэшем не найден")
+
+    try:
+        file_size = await get_size_by_hash(file_info.file_hash, s3_client=s3_client)
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=f"При получении размера файла произошла ошибка {err}")
+
     file_id = await add_file_to_db(
-        filename=file_info.file.filename,
-        file_size=file_info.file.size,
-        file_hash=file_hash,
+        filename=file_info.file_name,
+        file_size=file_size,
+        file_hash=file_info.file_hash,
         folder_id=file_info.folder_id,
         created_by="admin"
     )
 
+    logger.info(
+        "Файл %s создан по хэшу %s, не отправлено на s3 %s байт",
+        file_info.file_name, file_info.file_hash, file_size
+    )
+
     response.status_code = 201
-    return FileCreationResponse(message="Файл создан", file_key=file_id)
+    return FileCreationResponse(
+        message="Файл создан",
+        file_key=file_id,
+        deduplicated=True,
+        bytes_saved=file_size
+    )
+
+
+async def forget_file_meta(
+        file_key: str
+):
+    """
+    Удаляет закэшированные метаданные файла в redis и в памяти всех реплик,
+    чтобы скачивание взяло их из базы заново
+    :param file_key: ID файла
+    :return:
+    """
+    await get_redis().delete(file_meta_key(file_key))
+    await publish_file_meta_invalidation(file_key)
 
 
 async def remove_file(
@@ -190,6 +566,7 @@ async def remove_file(
         async with sessionmaker() as session, session.begin():
             await session.execute(delete(File).where(File.id == file_key)) # noqa
             await session.commit()
+        await forget_file_meta(file_key)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"При удалении файла возникла ошибка {e}")
 
@@ -197,20 +574,104 @@ async def remove_file(
     return BaseResponse(message=f"Файл с {file_key=} удален")
 
 
+def folder_tree_cte(
+        folder_id: str
+):
+    """
+    Рекурсивный CTE папок поддерева с путями относительно папки, тот же обход, что FOLDER_FILES_QUERY
+    в задаче сборки архива: папка, которая уже есть на пути от корня, не обходится,
+    поэтому циклы в дереве не зацикливают запрос
+    :param folder_id: ID папки
+    :return: CTE с колонками id, path, visited
+    """
+    folders = (
+        select(FileTree.id, literal_column("''::text").label("path"), array([FileTree.id]).label("visited"))
+        .where(FileTree.id == folder_id) # noqa
+        .cte("folders", recursive=True)
+    )
+    child = aliased(FileTree)
+    folders = folders.union_all(
+        select(child.id, folders.c.path + child.name + "/", folders.c.visited.op("||")(child.id))
+        .join(folders, child.parent_id == folders.c.id) # noqa
+        .where(child.id != all_(folders.c.visited)) # noqa
+    )
+    return folders
+
+
+async def folder_fingerprint(
+        session,
+        folder_id: str
+) -> str:
+    """
+    Отпечаток содержимого папки: sha256 по ID папки и отсортированным парам (путь, хэш)
+    файлов всего ее поддерева, тем же обходом, что и при сборке архива.
+    Если файлы папки не менялись, отпечаток тот же, и архив можно не собирать заново
+    :param session: Сессия базы
+    :param folder_id: ID папки
+    :return: Отпечаток папки
+    """
+    folders = folder_tree_cte(folder_id)
+    path = (folders.c.path + File.name).label("path")
+    result = await session.execute(
+        select(path, File.hash)
+        .join(folders, File.parent_id == folders.c.id) # noqa
+        .order_by(path, File.hash)
+    )
+
+    fingerprint = sha256(str(folder_id).encode())
+    for file_path, file_hash in result:
+        fingerprint.update(f"\0{file_path}\0{file_hash}".encode())
+    return fingerprint.hexdigest()
+
+
 async def push_archive(
-        folder_id: int,
+        folder_id: str,
         response: Response
 ) -> BaseResponse:
-    archive_request = ArchiveRequest(
-        folder_id=folder_id,
-        created_by="admin",
-        status="pending"
-    )
-
+    """
+    Контроллер создания архива папки.
+    Если архив с таким же содержимым уже собран или собирается, отдает его ID без новой сборки.
+    Упавшие сборки не переиспользуются
+    :param folder_id: ID папки
+    :return: ID архива
+    """
     sessionmaker = await get_async_session()
     async with sessionmaker() as session, session.begin():
+        fingerprint = await folder_fingerprint(session, folder_id)
+
+        # Блокировка до конца транзакции: одновременные запросы одной папки выполняются по очереди,
+        # и следующий находит архив, созданный предыдущим
+        await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(fingerprint))))
+
+        result = await session.execute(
+            select(ArchiveRequest)
+            .where(
+                ArchiveRequest.fingerprint == fingerprint, # noqa
+                # Сборка, которая упала (failed), не подходит, архив собирается заново
+                ArchiveRequest.status != "failed", # noqa
+                or_(
+                    ArchiveRequest.status == "finished", # noqa
+                    and_(
+                        ArchiveRequest.status == "pending", # noqa
+                        ArchiveRequest.created_at > func.now() - timedelta(seconds=config.archive_info.pending_timeout)
+                    )
+                )
+            )
+            .order_by(ArchiveRequest.created_at.desc())
+        )
+
+        for existing_request in result.scalars():
+            if existing_request.status == "pending" or os.path.exists(f"./temp/{existing_request.id}.zip"):
+                response.status_code = 200
+                return FileCreationResponse(message="Архив с таким содержимым уже создан", file_key=str(existing_request.id))
+
+        archive_request = ArchiveRequest(
+            folder_id=folder_id,
+            created_by="admin",
+            status="pending",
+            fingerprint=fingerprint
+        )
         session.add(archive_request)
-        await session.commit()
 
     create_archive.delay(folder_id, archive_request.id)
 
@@ -232,15 +693,17 @@ async def get_archive(
     async with sessionmaker() as session, session.begin():
         result = await session.execute(
             select(ArchiveRequest)
-            .where(
-                ArchiveRequest.id == archive_id, # noqa
-                ArchiveRequest.status == "finished" # noqa
-            )
+            .where(ArchiveRequest.id == archive_id) # noqa
         )
 
         request_obj: ArchiveRequest = result.scalars().one_or_none()
 
-        if not request_obj:
+        # Упавшую сборку повторять бесполезно, клиент должен запросить архив заново
+        if request_obj and request_obj.status == "failed":
+            response.status_code = 410
+            return BaseResponse(message="Архив не удалось собрать, его надо запросить заново")
+
+        if not request_obj or request_obj.status != "finished":
             response.status_code = 404
             return BaseResponse(message="Архив еще не готов")
 
@@ -277,63 +740,10 @@ async def rename_file_in_db(
                 .values(name=new_name)
             )
             await session.commit()
+        await forget_file_meta(file_key)
 
         response.status_code = 200
 
         return BaseResponse(message="Имя файла изменено")
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"При изменении имени файла произошла ошибка {err}")
-
-
-async def download_file_from_s3(
-        file_id: str,
-        response: Response, # noqa
-        background_tasks: BackgroundTasks # noqa
-) -> Union[FileResponse, BaseResponse]:
-    """
-    Отдает файл из хранилища либо их кэша
-    :param file_id: ID файла
-    :return: Файл или сообщение об ошибке
-    """
-    try:
-        r = Redis(host=config.cache_info.redis_host, port=config.cache_info.redis_port, db=1)
-
-        file_info = await r.get(f"cache:{file_id}")
-
-        await r.close()
-
-        if file_info:
-            file_info = json.loads(file_info)
-            return FileResponse(
-                path=file_info['path_to_cache'],
-                filename=file_info['file_name']
-            )
-
-        sessionmaker = await get_async_session()
-        async with sessionmaker() as session, session.begin():
-            result = await session.execute(
-                select(File)
-                .where(File.id == file_id) # noqa
-            )
-            await session.commit()
-
-            file_obj: File = result.scalars().one_or_none()
-
-        if not file_obj:
-            response.status_code = 404
-            return BaseResponse(message="Файл не найден")
-        try:
-            path_to_file = await get_file_from_s3(file_obj.hash)
-        except Exception as err:
-            response.status_code = 404
-            return BaseResponse(message=f"Файл найден в базе, но не найден в хранилище {err}")
-
-        response.status_code = 200
-        background_tasks.add_task(put_file_to_cache.delay, path_to_file, file_obj.hash, file_id, file_obj.name)
-        return FileResponse(
-            path=path_to_file,
-            filename=file_obj.name
-        )
-
-    except Exception as err:
-        raise HTTPException(status_code=500, detail=f"При скачивании файла произошла ошибка {err}")
@@ -0,0 +1,447 @@
+"""
+Сервисы для загрузки больших файлов частями через сессии загрузки.
+Состояние сессии хранится в redis, поэтому следующую часть может принять любая реплика API.
+Промежуточное состояние sha256 тоже хранится в redis и продвигается каждой частью, пришедшей по порядку,
+поэтому при завершении с s3 читается только то, что не успело попасть в хэш
+"""
+import asyncio
+import json
+import logging
+from base64 import b64decode, b64encode
+from typing import Optional, Union
+from uuid import uuid4
+
+from fastapi import HTTPException, Request, Response
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from config import config
+from hashing import Sha256State, update_hash
+from redis_pool import extend_lock, get_redis
+from schemas import (
+    BaseResponse,
+    FileCreationResponse,
+    UploadSessionCreationRequest,
+    UploadSessionResponse
+)
+from services.file_services import add_file_to_db, copy_s3_object, file_hash_exists
+
+logger = logging.getLogger(__name__)
+
+S3_MAX_PARTS = 10000
+
+
+def session_key(session_id: str) -> str:
+    return f"upload_session:{session_id}"
+
+
+def session_parts_key(session_id: str) -> str:
+    return f"upload_session:{session_id}:parts"
+
+
+def session_hash_key(session_id: str) -> str:
+    return f"upload_session:{session_id}:hash"
+
+
+def session_lock_key(session_id: str) -> str:
+    return f"upload_session:{session_id}:lock"
+
+
+def session_finalize_lock_key(session_id: str) -> str:
+    return f"upload_session:{session_id}:finalize"
+
+
+async def get_session_state(
+        r: Redis,
+        session_id: str
+) -> tuple[dict, dict[int, dict]]:
+    """
+    Читает состояние сессии загрузки из redis
+    :param r: Клиент redis
+    :param session_id: ID сессии загрузки
+    :return: Данные сессии и полученные части по номерам
+    """
+    session_info = await r.get(session_key(session_id))
+    if not session_info:
+        raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+
+    parts = await r.hgetall(session_parts_key(session_id))
+    return json.loads(session_info), {int(number): json.loads(part) for number, part in parts.items()}
+
+
+def build_session_response(
+        message: str,
+        session_id: str,
+        session_info: dict,
+        parts: dict[int, dict]
+) -> UploadSessionResponse:
+    """
+    Собирает ответ с прогрессом загрузки
+    :param message: Сообщение
+    :param session_id: ID сессии загрузки
+    :param session_info: Данные сессии
+    :param parts: Полученные части
+    :return: Прогресс загрузки
+    """
+    part_size = session_info["part_size"]
+    parts_count = -(-session_info["file_size"] // part_size)
+
+    return UploadSessionResponse(
+        message=message,
+        session_id=session_id,
+        part_size=part_size,
+        file_size=session_info["file_size"],
+        received_bytes=sum(part["size"] for part in parts.values()),
+        missing_offsets=[
+            (number - 1) * part_size
+            for number in range(1, parts_count + 1)
+            if number not in parts
+        ]
+    )
+
+
+async def create_upload_session(
+        session_info: UploadSessionCreationRequest,
+        response: Response, # noqa
+        s3_client
+) -> UploadSessionResponse:
+    """
+    Контроллер создания сессии загрузки.
+    Создает multipart загрузку на s3 под временным ключом и сохраняет ее состояние в redis
+    :param session_info: Информация о файле
+    :param s3_client: Клиент s3
+    :return: ID сессии и размер частей
+    """
+    part_size = config.s3_info.part_size
+    if -(-session_info.file_size // part_size) > S3_MAX_PARTS:
+        raise HTTPException(status_code=400, detail="Файл слишком большой для загрузки частями")
+
+    session_id = str(uuid4())
+    temp_key = f"temp/{session_id}"
+
+    multipart = await s3_client.create_multipart_upload(
+        Bucket=config.s3_info.bucket,
+        Key=temp_key
+    )
+
+    state = {
+        "upload_id": multipart["UploadId"],
+        "key": temp_key,
+        "file_name": session_info.file_name,
+        "folder_id": session_info.folder_id,
+        "file_size": session_info.file_size,
+        "content_type": session_info.content_type,
+        "part_size": part_size
+    }
+
+    r = get_redis()
+    await r.set(session_key(session_id), json.dumps(state), ex=config.cache_info.upload_session_ttl)
+
+    response.status_code = 201
+    return build_session_response("Сессия загрузки создана", session_id, state, {})
+
+
+async def read_chunk(
+        request: Request,
+        limit: int
+) -> bytes:
+    """
+    Читает тело запроса, не сохраняя его на диск
+    :param request: Запрос
+    :param limit: Максимальный размер тела
+    :return: Тело запроса
+    """
+    body = bytearray()
+    async for data in request.stream():
+        body.extend(data)
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail="Часть больше размера части сессии")
+    return bytes(body)
+
+
+async def record_chunk(
+        r: Redis,
+        session_id: str,
+        part_number: int,
+        offset: int,
+        chunk: bytes,
+        etag: str
+) -> dict:
+    """
+    Сохраняет загруженную часть и добавляет ее в хэш сессии, если она идет сразу за уже посчитанными данными.
+    В записи части хранится hashed_etag - ETag, с которым часть попала в хэш.
+    Если часть потом загрузят заново с другим содержимым, ETag не совпадет с hashed_etag,
+    и при завершении хэш будет посчитан заново.
+    Вызывается под блокировкой сессии
+    :param r: Клиент redis
+    :param session_id: ID сессии загрузки
+    :param part_number: Номер части
+    :param offset: Смещение части в файле
+    :param chunk: Содержимое части
+    :param etag: ETag, который s3 вернул на загрузку части
+    :return: Запись части
+    """
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hget(session_parts_key(session_id), str(part_number))
+        pipe.get(session_hash_key(session_id))
+        previous_part, hash_info = await pipe.execute()
+
+    hash_info = json.loads(hash_info) if hash_info else {"state": None, "offset": 0}
+    part = {"etag": etag, "size": len(chunk)}
+
+    if hash_info["offset"] == offset:
+        hasher = Sha256State(b64decode(hash_info["state"]) if hash_info["state"] else None)
+        await update_hash(hasher, chunk)
+        hash_info = {"state": b64encode(hasher.state()).decode(), "offset": offset + len(chunk)}
+        part["hashed_etag"] = etag
+    elif previous_part and offset < hash_info["offset"]:
+        part["hashed_etag"] = json.loads(previous_part).get("hashed_etag")
+
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(session_parts_key(session_id), str(part_number), json.dumps(part))
+        pipe.set(session_hash_key(session_id), json.dumps(hash_info), ex=config.cache_info.upload_session_ttl)
+        pipe.expire(session_parts_key(session_id), config.cache_info.upload_session_ttl)
+        pipe.expire(session_key(session_id), config.cache_info.upload_session_ttl)
+        await pipe.execute()
+    return part
+
+
+async def upload_chunk(
+        session_id: str,
+        offset: int,
+        request: Request,
+        response: Response, # noqa
+        s3_client
+) -> UploadSessionResponse:
+    """
+    Контроллер загрузки части файла.
+    Часть отправляется на s3 как part multipart загрузки с номером offset // part_size + 1.
+    Если части приходят по порядку, по ним сразу считается sha256, на какую бы реплику они ни пришли
+    :param session_id: ID сессии загрузки
+    :param offset: Смещение части в файле
+    :param request: Запрос, тело которого содержит часть файла
+    :param s3_client: Клиент s3
+    :return: Прогресс загрузки
+    """
+    r = get_redis()
+    session_info, parts = await get_session_state(r, session_id)
+    part_size = session_info["part_size"]
+    file_size = session_info["file_size"]
+
+    if offset % part_size or offset >= file_size:
+        raise HTTPException(status_code=400, detail=f"Смещение должно быть кратно {part_size} и меньше размера файла")
+
+    if session_info.get("completed") or await r.exists(session_finalize_lock_key(session_id)):
+        raise HTTPException(status_code=409, detail="Сессия загрузки уже завершается")
+
+    expected_size = min(part_size, file_size - offset)
+    chunk = await read_chunk(request, limit=expected_size)
+    if len(chunk) != expected_size:
+        raise HTTPException(status_code=400, detail=f"Ожидалась часть размером {expected_size} байт")
+
+    part_number = offset // part_size + 1
+    part = await s3_client.upload_part(
+        Bucket=config.s3_info.bucket,
+        Key=session_info["key"],
+        UploadId=session_info["upload_id"],
+        PartNumber=part_number,
+        Body=chunk
+    )
+    # Хэш продвигается только после успешной загрузки части, иначе повтор части посчитал бы ее дважды.
+    # Части одной сессии записываются по очереди, чтобы две реплики не продвинули хэш одновременно
+    async with r.lock(
+            session_lock_key(session_id),
+            timeout=config.cache_info.upload_lock_timeout,
+            blocking_timeout=config.cache_info.upload_lock_timeout
+    ):
+        parts[part_number] = await record_chunk(r, session_id, part_number, offset, chunk, etag=part["ETag"])
+
+    response.status_code = 200
+    return build_session_response("Часть файла получена", session_id, session_info, parts)
+
+
+async def get_upload_session(
+        session_id: str,
+        response: Response # noqa
+) -> UploadSessionResponse:
+    """
+    Контроллер получения прогресса загрузки
+    :param session_id: ID сессии загрузки
+    :return: Прогресс загрузки
+    """
+    r = get_redis()
+    session_info, parts = await get_session_state(r, session_id)
+
+    response.status_code = 200
+    return build_session_response("Прогресс загрузки", session_id, session_info, parts)
+
+
+async def calculate_session_hash(
+        session_info: dict,
+        parts: dict[int, dict],
+        hash_info: Optional[dict],
+        s3_client
+) -> str:
+    """
+    Досчитывает sha256 файла сессии.
+    Сохраненному состоянию можно верить, только если каждая посчитанная часть не менялась после этого.
+    Остаток файла после посчитанных частей читается с s3 одним ranged запросом
+    :param session_info: Данные сессии
+    :param parts: Полученные части
+    :param hash_info: Состояние хэша сессии из redis
+    :param s3_client: Клиент s3
+    :return: sha256 хэш
+    """
+    hashed_offset = hash_info["offset"] if hash_info else 0
+    hashed_parts = range(1, -(-hashed_offset // session_info["part_size"]) + 1)
+
+    if hashed_offset and all(parts[number].get("hashed_etag") == parts[number]["etag"] for number in hashed_parts):
+        hasher = Sha256State(b64decode(hash_info["state"]))
+    else:
+        hasher = Sha256State()
+        hashed_offset = 0
+
+    if hashed_offset < session_info["file_size"]:
+        logger.info(
+            "Хэш сессии посчитан по %s байт из %s, остаток будет прочитан с s3",
+            hashed_offset, session_info["file_size"]
+        )
+        s3_object = await s3_client.get_object(
+            Bucket=config.s3_info.bucket,
+            Key=session_info["key"],
+            Range=f"bytes={hashed_offset}-"
+        )
+        # Контекст тела отдает ответ aiohttp, у которого read() читает все сразу, поэтому читается само тело
+        body = s3_object["Body"]
+        async with body:
+            while data := await body.read(config.s3_info.part_size):
+                await update_hash(hasher, data)
+
+    return hasher.hexdigest()
+
+
+async def finalize_upload_session(
+        session_id: str,
+        response: Response, # noqa
+        s3_client
+) -> Union[FileCreationResponse, UploadSessionResponse]:
+    """
+    Контроллер завершения сессии загрузки.
+    Завершает multipart загрузку, переносит файл под ключ files/{hash}
+    (или удаляет его, если такое содержимое уже есть) и создает запись в базе.
+    Сессия удаляется только после записи в базу, поэтому после ошибки завершение можно повторить
+    :param session_id: ID сессии загрузки
+    :param s3_client: Клиент s3
+    :return: ID нового файла или ошибка
+    """
+    r = get_redis()
+    finalize_lock = r.lock(session_finalize_lock_key(session_id), timeout=config.cache_info.upload_lock_timeout)
+    if not await finalize_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Сессия загрузки уже завершается")
+
+    lock_extension = asyncio.create_task(extend_lock(finalize_lock))
+    try:
+        # Ждем части, которые сейчас записываются, чтобы завершить загрузку с ними
+        async with r.lock(
+                session_lock_key(session_id),
+                timeout=config.cache_info.upload_lock_timeout,
+                blocking_timeout=config.cache_info.upload_lock_timeout
+        ):
+            session_info, parts = await get_session_state(r, session_id)
+            hash_info = await r.get(session_hash_key(session_id))
+
+        progress = build_session_response("Получены не все части файла", session_id, session_info, parts)
+        if progress.missing_offsets:
+            response.status_code = 409
+            return progress
+
+        # Повторное завершение после ошибки не завершает multipart загрузку второй раз
+        if not session_info.get("completed"):
+            await s3_client.complete_multipart_upload(
+                Bucket=config.s3_info.bucket,
+                Key=session_info["key"],
+                UploadId=session_info["upload_id"],
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": parts[number]["etag"], "PartNumber": number}
+                        for number in sorted(parts)
+                    ]
+                }
+            )
+            session_info["completed"] = True
+            await r.set(session_key(session_id), json.dumps(session_info), keepttl=True)
+
+        file_hash = await calculate_session_hash(
+            session_info,
+            parts,
+            hash_info=json.loads(hash_info) if hash_info else None,
+            s3_client=s3_client
+        )
+
+        deduplicated = await file_hash_exists(file_hash)
+        if not deduplicated:
+            await copy_s3_object(
+                s3_client=s3_client,
+                source_key=session_info["key"],
+                target_key=f"files/{file_hash}",
+                object_size=session_info["file_size"]
+            )
+
+        file_id = await add_file_to_db(
+            filename=session_info["file_name"],
+            file_size=session_info["file_size"],
+            file_hash=file_hash,
+            folder_id=session_info["folder_id"],
+            created_by="admin",
+            content_type=session_info["content_type"]
+        )
+
+        await r.delete(session_key(session_id), session_parts_key(session_id), session_hash_key(session_id))
+        await s3_client.delete_object(Bucket=config.s3_info.bucket, Key=session_info["key"])
+    finally:
+        lock_extension.cancel()
+        try:
+            await finalize_lock.release()
+        except LockError:
+            pass
+
+    response.status_code = 201
+    return FileCreationResponse(message="Файл создан", file_key=file_id, deduplicated=deduplicated)
+
+
+async def abort_upload_session(
+        session_id: str,
+        response: Response, # noqa
+        s3_client
+) -> BaseResponse:
+    """
+    Контроллер отмены сессии загрузки.
+    Сессию, которая сейчас завершается, отменить нельзя
+    :param session_id: ID сессии загрузки
+    :param s3_client: Клиент s3
+    :return: Сообщение об отмене или ошибка
+    """
+    r = get_redis()
+    finalize_lock = r.lock(session_finalize_lock_key(session_id), timeout=config.cache_info.upload_lock_timeout)
+    if not await finalize_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Сессия загрузки уже завершается")
+
+    try:
+        session_info, _ = await get_session_state(r, session_id)
+        if session_info.get("completed"):
+            await s3_client.delete_object(Bucket=config.s3_info.bucket, Key=session_info["key"])
+        else:
+            await s3_client.abort_multipart_upload(
+                Bucket=config.s3_info.bucket,
+                Key=session_info["key"],
+                UploadId=session_info["upload_id"]
+            )
+        await r.delete(session_key(session_id), session_parts_key(session_id), session_hash_key(session_id))
+    finally:
+        try:
+            await finalize_lock.release()
+        except LockError:
+            pass
+
+    response.status_code = 200
+    return BaseResponse(message="Сессия загрузки отменена")
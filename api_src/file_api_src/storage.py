@@ -0,0 +1,46 @@
+import aioboto3
+from aiobotocore.config import AioConfig
+from fastapi import Request
+
+from config import config
+
+s3_session = aioboto3.Session()
+
+
+def create_s3_client(
+        endpoint: str = config.s3_info.endpoint
+):
+    """
+    Создает клиент s3 с пулом соединений.
+    Клиент создается один раз на процесс в lifespan приложения
+    :param endpoint: Адрес s3
+    :return: Асинхронный контекстный менеджер клиента s3
+    """
+    return s3_session.client(
+        "s3",
+        endpoint_url=endpoint,
+        aws_access_key_id=config.s3_info.access_key,
+        aws_secret_access_key=config.s3_info.secret_key,
+        config=AioConfig(
+            max_pool_connections=config.s3_info.max_pool_connections,
+            tcp_keepalive=True,
+            connector_args={"keepalive_timeout": config.s3_info.keepalive_timeout}
+        )
+    )
+
+
+async def get_s3_client(request: Request):
+    """
+    Отдает клиент s3, созданный при старте приложения
+    :return: Клиент s3
+    """
+    return request.app.state.s3_client
+
+
+async def get_s3_presign_client(request: Request):
+    """
+    Отдает клиент s3 для подписи ссылок на скачивание.
+    Он настроен на публичный адрес s3, потому что адрес входит в подпись ссылки
+    :return: Клиент s3
+    """
+    return request.app.state.s3_presign_client
@@ -1,15 +1,14 @@
 """
 Модуль для описания работы селери
 """
-from datetime import datetime, timedelta
 import os
 import uuid
 from zipfile import ZipFile
 
 import psycopg
-from celery import Celery, group, chord
+from celery import Celery
 
-from celery_tasks import move_file_to_cache, download_file
+from celery_tasks import move_file_to_cache, evict_cache_files, download_file, write_archive, iter_folder_files
 from config import config
 
 celery = Celery(
@@ -21,16 +20,23 @@ celery = Celery(
     broker_connection_retry_on_startup=True
 )
 
+celery.conf.beat_schedule = {
+    "evict_cache": {
+        "task": "evict_cache",
+        "schedule": config.cache_info.evict_interval
+    }
+}
+
 
 @celery.task(
-    name="clear_cache"
+    name="evict_cache"
 )
-def clear_cache_file(
-        path_to_file: str
-):
-    if os.path.exists(path_to_file):
-        os.remove(path_to_file)
-
+def evict_cache() -> int:
+    """
+    Периодическая задача, которая держит размер ./cache в пределах CACHE_MAX_SIZE
+    :return: Количество удаленных файлов
+    """
+    return evict_cache_files()
 
 
 @celery.task(
@@ -51,10 +57,10 @@ def put_file_to_cache(
         file_name=file_name
     )
 
-    six_hours_delta = datetime.now() + timedelta(hours=6)
-
-    clear_cache_file.apply_async(path_to_file=f"./cache/{file_hash}", eta=six_hours_delta)
 
+# download_file_from_s3 и archive_files - прежняя сборка архива через chord с задачей на каждый файл.
+# Остаются зарегистрированными, чтобы доработали chord, поставленные до обновления,
+# и для сравнения в benchmarks/archive_benchmark.py
 
 @celery.task(
     name="download_file_from_s3",
@@ -91,12 +97,12 @@ def archive_files(*args):
     file_paths_and_names = [(x[0], x[1]) for x in args[0]]
 
     with ZipFile(path_to_archive, "w") as inzip:
-        computed_names = []
+        computed_names = set()
         for file, name in file_paths_and_names:
             if name in computed_names:
                 name = f"{uuid.uuid4()}.{name}"
             inzip.write(file, arcname=name)
-            computed_names.append(name)
+            computed_names.add(name)
             os.remove(file)
 
     connection_string = config.db_info.database_url.replace("+asyncpg", "")
@@ -113,29 +119,75 @@ def archive_files(*args):
     return path_to_archive
 
 
+def mark_archive_failed(
+        task, # noqa
+        exc, # noqa
+        task_id, # noqa
+        args,
+        kwargs,
+        einfo # noqa
+):
+    """
+    Обработчик падения create_archive после всех повторов.
+    Отмечает запрос архива как failed и удаляет недописанный архив,
+    чтобы клиент не ждал архив, который уже не появится
+    :param args: Аргументы задачи
+    :param kwargs: Именованные аргументы задачи
+    :return:
+    """
+    archive_id = kwargs.get("archive_id") or args[1]
+
+    path_to_archive = f"./temp/{archive_id}.zip"
+    if os.path.exists(path_to_archive):
+        os.remove(path_to_archive)
+
+    connection_string = config.db_info.database_url.replace("+asyncpg", "")
+
+    with psycopg.connect(connection_string) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "update app.archive_requests set status = 'failed' where id = %s",
+                (archive_id,)
+            )
+            conn.commit()
+
+
 @celery.task(
     name='create_archive',
     autoretry_for=(Exception,),
-    retry_kwargs={'max_retries': 3}
+    retry_kwargs={'max_retries': 3},
+    on_failure=mark_archive_failed
 )
 def create_archive(
-        folder_id: int,
+        folder_id: str,
         archive_id: str
-):
+) -> str:
+    """
+    Celery задача для сборки архива папки вместе со всеми вложенными папками.
+    Весь архив собирается в одной задаче: файлы качаются пулом потоков через общий клиент s3
+    и сразу дописываются в ZIP, без отдельной задачи на каждый файл.
+    Файлы лежат в архиве по своим путям относительно папки.
+    Если сборка не удалась и после повторов, запрос архива отмечается как failed
+    :param folder_id: ID папки
+    :param archive_id: ID архива
+    :return: Путь к архиву
+    """
 
     connection_string = config.db_info.database_url.replace("+asyncpg", "")
 
+    with psycopg.connect(connection_string) as conn:
+        path_to_archive = write_archive(
+            iter_folder_files(conn, folder_id=folder_id, archive_id=archive_id),
+            path_to_archive=f"./temp/{archive_id}.zip"
+        )
+
     with psycopg.connect(connection_string) as conn:
         with conn.cursor() as cursor:
             cursor.execute(
-                f"""
-                select id, hash, name from app.files where parent_id = {folder_id}
-                """
+                "update app.archive_requests set status = 'finished' where id = %s",
+                (archive_id,)
             )
-            all_files = cursor.fetchall()
-            all_files = [[str(x[0]), x[1], x[2]] for x in all_files]
+            conn.commit()
 
-    chord(
-        group(download_file_from_s3.s(file_id, file_hash, file_name, archive_id) for file_id, file_hash, file_name in all_files)
-    )(archive_files.s())
+    return path_to_archive
 